@@ -0,0 +1,46 @@
+# Author: William Liu <liwi@ohsu.edu>
+
+import importlib
+import importlib.util
+import types
+
+
+class LazyPackage(types.ModuleType):
+    """
+    Module class for packages that import their submodules on first
+    attribute access, so importing the package stays cheap.
+
+    The package defines _LAZY, a dict of public name to the submodule that
+    defines it, and then sets
+    sys.modules[__name__].__class__ = LazyPackage. Submodules themselves,
+    e.g. processing.filter, are also imported on first access.
+    """
+    def __getattr__(self, name):
+        lazy = self.__dict__.get('_LAZY', {})
+        if name in lazy:
+            module = importlib.import_module('.' + lazy[name], self.__name__)
+            value = getattr(module, name)
+            # Cache so later lookups skip __getattr__
+            self.__dict__[name] = value
+            return value
+
+        if (not name.startswith('__')
+                and importlib.util.find_spec(f'{self.__name__}.{name}')):
+            # Importing binds the submodule on the package
+            return importlib.import_module('.' + name, self.__name__)
+
+        raise AttributeError(
+            f"module {self.__name__!r} has no attribute {name!r}"
+            )
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(self.__dict__['_LAZY']))
+
+    def __setattr__(self, name, value):
+        # Importing a submodule binds it on the package. Where the submodule
+        # shares its name with the function it defines, bind the function
+        # instead, as eager imports of the package used to.
+        lazy = self.__dict__.get('_LAZY', {})
+        if isinstance(value, types.ModuleType) and lazy.get(name) == name:
+            value = getattr(value, name)
+        super().__setattr__(name, value)
@@ -1,3 +1,17 @@
 # Author: William Liu <liwi@ohsu.edu>
 
-from .read_raw import read_raw
\ No newline at end of file
+import sys
+from _lazy_package import LazyPackage
+
+# Readers are imported on first attribute access (see LazyPackage), so only the
+# reader that is actually used pays its import cost.
+_LAZY = {
+    'read_raw': 'read_raw',
+    'read_snirf': '_snirf',
+    'write_snirf': '_snirf',
+    'Prefetcher': 'prefetch',
+}
+
+__all__ = list(_LAZY)
+
+sys.modules[__name__].__class__ = LazyPackage
@@ -2,8 +2,6 @@
 
 import math
 import pandas as pd
-import scipy.io as sio
-import scipy.signal as signal
 import numpy as np
 
 
@@ -14,6 +12,8 @@ def read_mat(file_path: str) -> dict:
     :param file_path: path to the raw data file
     :return: dictionary of metadata and raw fnirs data
     """
+    import scipy.io as sio
+
     # Load the .mat file into a dictionary
     mat_dict = sio.loadmat(file_path)
 
@@ -69,6 +69,8 @@ def _get_events(raw: dict) -> pd.Series:
     :param raw: a dictionary of loaded .mat data
     :return: a pd.Series containing the frames where events were marked
     """
+    import scipy.signal as signal
+
     # Define series of NaN to return if no events are found
     events = pd.Series(data=[np.nan])
 
@@ -0,0 +1,227 @@
+# Author: William Liu <liwi@ohsu.edu>
+
+import re
+import pandas as pd
+import numpy as np
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+# Chromophore labels used in column names and their SNIRF dataTypeLabel
+_LABELS = {'O2Hb': 'HbO', 'HHb': 'HbR', 'HbT': 'HbT'}
+_CHANNEL_REGEX = re.compile(r'^(Rx\d+)-(Tx\d+) (O2Hb|HHb|HbT)$')
+
+
+def write_snirf(file_path: str, data: dict, chunk_samples=1024,
+                compression='gzip'):
+    """
+    Write fNIRS data to a SNIRF (HDF5) file.
+
+    Works for both raw data from read_raw and processed data, e.g.
+    {'metadata': raw['metadata'], 'data': process_fnirs(raw, short_chs)}.
+    The time series is stored chunked by channel and by blocks of
+    chunk_samples samples and compressed, so single channels or time ranges
+    can be read back without reading the whole file. Event markers are
+    stored as stim groups and the metadata as metaDataTags.
+
+    https://github.com/fNIRS/snirf
+
+    :param file_path: path of the .snirf file to create
+    :param data: dictionary with fnirs data (a dataframe) and metadata
+    :param chunk_samples: number of samples per chunk
+    :param compression: HDF5 compression filter, or None
+    """
+    _require_h5py()
+    df = data['data']
+    metadata = data['metadata']
+    fs = float(metadata['Datafile sample rate'])
+
+    chs = [ch for ch in df.columns
+           if not ('Sample number' in ch or 'Event' in ch)]
+    parsed = [_CHANNEL_REGEX.match(ch) for ch in chs]
+    unsupported = [ch for ch, match in zip(chs, parsed) if match is None]
+    if unsupported:
+        raise ValueError(f"Cannot store channels in SNIRF: {unsupported}")
+
+    detectors = sorted({m.group(1) for m in parsed}, key=_label_number)
+    sources = sorted({m.group(2) for m in parsed}, key=_label_number)
+    sample_numbers = np.array(df['Sample number'], dtype=np.float64)
+    values = np.array(df[chs], dtype=np.float64)
+
+    with h5py.File(file_path, 'w') as f:
+        f.create_dataset('formatVersion', data='1.1')
+        nirs = f.create_group('nirs')
+
+        tags = nirs.create_group('metaDataTags')
+        defaults = {'SubjectID': metadata.get('Original file', 'unknown'),
+                    'MeasurementDate': 'unknown',
+                    'MeasurementTime': 'unknown',
+                    'LengthUnit': 'mm', 'TimeUnit': 's',
+                    'FrequencyUnit': 'Hz'}
+        for key, value in {**defaults, **metadata}.items():
+            tags.create_dataset(key.replace('/', '_'), data=str(value))
+
+        data1 = nirs.create_group('data1')
+        chunks = (min(chunk_samples, len(values)), 1)
+        data1.create_dataset('dataTimeSeries', data=values, chunks=chunks,
+                             compression=compression, shuffle=True)
+        data1.create_dataset('time', data=sample_numbers / fs,
+                             compression=compression)
+        for idx, match in enumerate(parsed):
+            ml = data1.create_group(f'measurementList{idx + 1}')
+            ml.create_dataset('sourceIndex', data=sources.index(match[2]) + 1)
+            ml.create_dataset('detectorIndex',
+                              data=detectors.index(match[1]) + 1)
+            ml.create_dataset('wavelengthIndex', data=1)
+            # 99999 is the SNIRF data type of processed data, which includes
+            # hemoglobin concentrations
+            ml.create_dataset('dataType', data=99999)
+            ml.create_dataset('dataTypeLabel', data=_LABELS[match[3]])
+            ml.create_dataset('dataTypeIndex', data=1)
+
+        probe = nirs.create_group('probe')
+        # Wavelengths of the Artinis devices, required by the format
+        probe.create_dataset('wavelengths', data=[760.0, 850.0])
+        probe.create_dataset('sourceLabels', data=sources,
+                             dtype=h5py.string_dtype())
+        probe.create_dataset('detectorLabels', data=detectors,
+                             dtype=h5py.string_dtype())
+        probe.create_dataset('sourcePos3D', data=np.zeros((len(sources), 3)))
+        probe.create_dataset('detectorPos3D',
+                             data=np.zeros((len(detectors), 3)))
+
+        events = df[df['Event'].notnull()]
+        for idx, name in enumerate(pd.unique(events['Event'])):
+            onsets = (
+                np.array(events.loc[events['Event'] == name, 'Sample number'],
+                         dtype=np.float64) / fs
+                )
+            stim = nirs.create_group(f'stim{idx + 1}')
+            stim.create_dataset('name', data=str(name))
+            stim.create_dataset('data', data=np.column_stack(
+                [onsets, np.zeros(len(onsets)), np.ones(len(onsets))]))
+
+
+def read_snirf(file_path: str, channels=None, start=None,
+               stop=None) -> dict:
+    """
+    Read a SNIRF file of hemoglobin concentrations, e.g. written by
+    write_snirf.
+
+    Only the requested channels and samples are read from disk. Files from
+    other software may lack the sample rate tag and the probe labels; the
+    sample rate is then derived from the time vector and the optodes are
+    named S1, D1, etc.
+
+    :param file_path: path to the .snirf file
+    :param channels: optional list of channels to read, e.g. ['Rx1-Tx1 O2Hb']
+    :param start: optional index of the first sample to read
+    :param stop: optional index after the last sample to read
+    :return: dictionary of metadata and fnirs data, as returned by read_raw
+    """
+    _require_h5py()
+    with h5py.File(file_path, 'r') as f:
+        nirs = f['nirs'] if 'nirs' in f else f['nirs1']
+        metadata = {key: _to_str(value[()])
+                    for key, value in nirs['metaDataTags'].items()}
+
+        data1 = nirs['data1']
+        n_samples = data1['dataTimeSeries'].shape[0]
+        time = np.array(data1['time'][()], dtype=np.float64)
+        if len(time) == 2 and n_samples != 2:
+            # Regularly sampled data may store only [start, spacing]
+            time = time[0] + time[1] * np.arange(n_samples)
+        if 'Datafile sample rate' in metadata:
+            fs = float(metadata['Datafile sample rate'])
+        else:
+            fs = 1 / np.median(np.diff(time))
+            metadata['Datafile sample rate'] = str(fs)
+
+        probe = nirs['probe']
+        sources = _optode_labels(probe, 'sourceLabels', 'S')
+        detectors = _optode_labels(probe, 'detectorLabels', 'D')
+        labels = {value: key for key, value in _LABELS.items()}
+
+        n_ml = len([k for k in data1 if k.startswith('measurementList')])
+        all_chs = list()
+        for idx in range(1, n_ml + 1):
+            ml = data1[f'measurementList{idx}']
+            source = sources(int(ml['sourceIndex'][()]))
+            detector = detectors(int(ml['detectorIndex'][()]))
+            if 'dataTypeLabel' in ml:
+                data_type = _to_str(ml['dataTypeLabel'][()])
+            else:
+                data_type = f"dataType {int(ml['dataType'][()])}"
+            if data_type not in labels:
+                raise ValueError(
+                    f"Unsupported data type {data_type} in {file_path}. "
+                    f"Expected one of {list(labels)}."
+                    )
+            all_chs.append(f'{detector}-{source} {labels[data_type]}')
+
+        if channels is None:
+            columns = list(range(len(all_chs)))
+        else:
+            missing = [ch for ch in channels if ch not in all_chs]
+            if missing:
+                raise KeyError(f"Channels not found in {file_path}: {missing}")
+            # HDF5 selections need increasing indexes
+            columns = sorted(all_chs.index(ch) for ch in channels)
+
+        rows = slice(start, stop)
+        values = data1['dataTimeSeries'][rows, columns]
+        time = time[rows]
+
+        stims = list()
+        for key in nirs:
+            if key.startswith('stim'):
+                name = _to_str(nirs[key]['name'][()])
+                onsets = np.atleast_2d(nirs[key]['data'][()])[:, 0]
+                stims.append((name, onsets))
+
+    sample_numbers = np.round(time * fs).astype(np.int64)
+    df = pd.DataFrame(data=values, columns=[all_chs[i] for i in columns],
+                      index=sample_numbers)
+    df.insert(0, 'Sample number', sample_numbers)
+
+    events = pd.Series(np.nan, index=df.index, dtype=object)
+    for name, onsets in stims:
+        for sample in np.round(onsets * fs).astype(np.int64):
+            if sample in events.index:
+                events[sample] = name
+    df['Event'] = events
+
+    metadata.setdefault('Export file', file_path)
+    metadata['SNIRF file'] = file_path
+
+    return {'metadata': metadata, 'data': df}
+
+
+def _require_h5py():
+    if h5py is None:
+        raise ImportError("Reading and writing SNIRF files requires h5py.")
+
+
+def _optode_labels(probe, key: str, prefix: str):
+    """
+    Function mapping a 1-based optode index to its label. The labels are
+    optional in SNIRF, so fall back to prefix + index.
+    """
+    if key not in probe:
+        return lambda idx: f'{prefix}{idx}'
+
+    labels = [_to_str(label) for label in probe[key][()]]
+    return lambda idx: labels[idx - 1]
+
+
+def _label_number(label: str) -> int:
+    """Sort 'Tx10' after 'Tx9'."""
+    return int(re.sub(r'\D', '', label))
+
+
+def _to_str(value) -> str:
+    if isinstance(value, bytes):
+        return value.decode()
+    return str(value)
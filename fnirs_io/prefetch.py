@@ -0,0 +1,137 @@
+# Author: William Liu <liwi@ohsu.edu>
+
+import collections
+import threading
+import time
+from .read_raw import read_raw
+
+
+class Prefetcher:
+    """
+    Iterate over recordings while the next ones are read on a background
+    thread, so reading files overlaps with processing them.
+
+    At most max_files parsed recordings wait in the buffer, and their
+    combined size is kept within max_bytes. The size of a recording is only
+    known once it is parsed, so peak memory is max_bytes plus the recording
+    the background thread is reading or holding until there is room. A
+    single recording larger than max_bytes is still passed through, one at a
+    time.
+
+    By default a read error is raised to the consumer when its file comes
+    up, and nothing after it is read. With skip_errors=True the file is
+    skipped instead, the error is stored in the errors attribute (a dict of
+    file path to exception) and reading continues.
+
+    Timing, in seconds, is collected in the stats attribute:
+    'read' - time spent reading and parsing files on the background thread
+    'wait' - time the consumer was idle waiting for a file to be read
+    'blocked' - time the reader waited for room in the buffer
+
+    Example:
+        with Prefetcher(files) as recordings:
+            for file, raw in recordings:
+                processed = process_fnirs(raw, short_chs)
+    """
+    def __init__(self, files: list, max_files=2, max_bytes=512 * 2**20,
+                 reader=read_raw, skip_errors=False):
+        if max_files < 1:
+            raise ValueError(f"max_files must be at least 1, not {max_files}")
+
+        self.files = list(files)
+        self.max_files = max_files
+        self.max_bytes = max_bytes
+        self.reader = reader
+        self.skip_errors = skip_errors
+        self.stats = {'read': 0.0, 'wait': 0.0, 'blocked': 0.0}
+        self.errors = dict()
+
+        self._buffer = collections.deque()
+        self._used_bytes = 0
+        self._done = False
+        self._closed = False
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __iter__(self):
+        if self._thread is not None:
+            raise RuntimeError("A Prefetcher can only be iterated once.")
+        self._thread = threading.Thread(target=self._read_all, daemon=True)
+        self._thread.start()
+
+        try:
+            while True:
+                start = time.perf_counter()
+                with self._condition:
+                    while not self._buffer and not self._done:
+                        self._condition.wait()
+                    self.stats['wait'] += time.perf_counter() - start
+                    if not self._buffer:
+                        return
+                    file, data, size, error = self._buffer.popleft()
+                    self._used_bytes -= size
+                    self._condition.notify_all()
+
+                if error is None:
+                    yield file, data
+                elif self.skip_errors:
+                    self.errors[file] = error
+                else:
+                    raise error
+        finally:
+            self.close()
+
+    def close(self):
+        """Stop reading ahead and wait for the background thread to end."""
+        with self._condition:
+            self._closed = True
+            self._buffer.clear()
+            self._used_bytes = 0
+            self._condition.notify_all()
+        if (self._thread is not None
+                and self._thread is not threading.current_thread()):
+            self._thread.join()
+
+    def _read_all(self):
+        """Background thread: read files in order into the buffer."""
+        for file in self.files:
+            start = time.perf_counter()
+            try:
+                data = self.reader(file)
+                size = _size_of(data)
+                error = None
+            except Exception as e:
+                data, size, error = None, 0, e
+            self.stats['read'] += time.perf_counter() - start
+
+            start = time.perf_counter()
+            with self._condition:
+                while not self._closed and self._buffer and (
+                        len(self._buffer) >= self.max_files
+                        or self._used_bytes + size > self.max_bytes):
+                    self._condition.wait()
+                self.stats['blocked'] += time.perf_counter() - start
+                if self._closed:
+                    return
+                self._buffer.append((file, data, size, error))
+                self._used_bytes += size
+                self._condition.notify_all()
+
+            # Nothing after a raised error is delivered, so stop reading
+            if error is not None and not self.skip_errors:
+                break
+
+        with self._condition:
+            self._done = True
+            self._condition.notify_all()
+
+
+def _size_of(data: dict) -> int:
+    """Approximate memory used by a parsed recording, in bytes."""
+    return int(data['data'].memory_usage(deep=True).sum())
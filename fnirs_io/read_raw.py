@@ -1,17 +1,20 @@
 # Author: William Liu <liwi@ohsu.edu>
 
-import pandas as pd
 import os
-from ._read_txt import read_txt
-from ._read_mat import read_mat
 
 def read_raw(file_path: str):
     filename, file_extension = os.path.splitext(file_path)
+    # Import only the reader that is needed
     if file_extension == '.txt':
+        from ._read_txt import read_txt
         raw_fnirs = read_txt(file_path)
     elif file_extension == '.mat':
+        from ._read_mat import read_mat
         raw_fnirs = read_mat(file_path)
+    elif file_extension == '.snirf':
+        from ._snirf import read_snirf
+        raw_fnirs = read_snirf(file_path)
     else:
-        raise TypeError(f"File provided in {file_extension} format. Expected .txt or .mat.")
+        raise TypeError(f"File provided in {file_extension} format. Expected .txt, .mat or .snirf.")
     
     return raw_fnirs
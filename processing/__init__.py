@@ -1,6 +1,42 @@
 # Author: William Liu <liwi@ohsu.edu>
 
-from .process import process_fnirs
-from .average_channels import *
-from .create_segments import *
-from .statistics import *
+import sys
+from _lazy_package import LazyPackage
+
+# Submodules are imported on first attribute access (see LazyPackage), so
+# importing the package does not pull in pandas or SciPy until they are needed.
+_LAZY = {
+    'process_fnirs': 'process',
+    'average_channels': 'average_channels',
+    'create_segments': 'create_segments',
+    'calculate_statistics': 'statistics',
+    'detrended_mean': 'statistics',
+    'permutation_test': 'group_statistics',
+    'bootstrap_ci': 'group_statistics',
+    'glm_statistics': 'glm',
+    'design_matrix': 'glm',
+    'derived_signals': 'derived_signals',
+    'sliding_connectivity': 'connectivity',
+    'segment_connectivity': 'connectivity',
+    'interhemispheric_connectivity': 'connectivity',
+    'signal_quality': 'quality',
+    'is_usable': 'quality',
+    'drop_failed': 'quality',
+    'quality_report': 'quality',
+    'Pipeline': 'pipeline',
+    'ExecutionPlan': 'pipeline',
+    'register_stage': 'pipeline',
+    'sweep': 'sweep',
+    'process_files': 'batch',
+    'ResultsStore': 'results_db',
+    'file_hash': 'results_db',
+    'process_cohort': 'results_db',
+    'minmax_downsample': 'report',
+    'lttb_downsample': 'report',
+    'render_page': 'report',
+    'generate_reports': 'report',
+}
+
+__all__ = list(_LAZY)
+
+sys.modules[__name__].__class__ = LazyPackage
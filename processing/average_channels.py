@@ -4,17 +4,22 @@ import pandas as pd
 import numpy as np
 
 
-def average_channels(df: pd.DataFrame) -> pd.DataFrame:
+def average_channels(df: pd.DataFrame, exclude=None) -> pd.DataFrame:
     """
     Average channels across each hemisphere and the entire brain (grand).
 
     :param df: dataframe of processed fnirs, without short channels
+    :param exclude: optional list of channels (e.g. 'Rx1-Tx1') to leave out
+                    of the averages, such as those failing signal_quality
     :return: dataframe of averaged channels
     """
     if type(df) != pd.DataFrame:
         raise TypeError(f"Must provide a dataframe, not {type(df)}")
 
     df_copy = df.copy()
+    if exclude:
+        df_copy = df_copy.drop(columns=[ch for ch in df_copy.columns
+                                        if ch.rsplit(' ', 1)[0] in exclude])
     # Create dictionary of averaged channels
     dict_for_df = {
         'Sample number': df_copy['Sample number'],
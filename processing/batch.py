@@ -0,0 +1,73 @@
+# Author: William Liu <liwi@ohsu.edu>
+
+import time
+from fnirs_io import Prefetcher, read_raw
+from .process import process_fnirs
+from .quality import signal_quality, is_usable, drop_failed, quality_report
+
+
+def process_files(files: list, short_chs: list, max_files=2,
+                  max_bytes=512 * 2**20, reader=read_raw, qc=False,
+                  **kwargs):
+    """
+    Run process_fnirs on a batch of recordings, reading the next files on a
+    background thread while the current one is processed.
+
+    A file that fails to read or process does not stop the batch: it is
+    left out of the results and its exception is kept in 'failed'. With qc,
+    recordings that fail quality control are skipped before processing and
+    failing channels are left out, as in process_fnirs(qc=True).
+
+    :param files: paths of the recordings to process
+    :param short_chs: list of the short (reference) channels
+    :param max_files: number of recordings to read ahead
+    :param max_bytes: memory budget for recordings read ahead, see Prefetcher
+    :param reader: function reading a file, fnirs_io.read_raw by default
+    :param qc: if True, screen every recording with signal_quality and
+               report the batch in 'quality', see quality_report
+    :param kwargs: passed on to process_fnirs
+    :return: dict of file path to processed dataframe, and a dict describing
+             the run. 'failed' is a dict of file path to exception and, with
+             qc, 'quality' is the quality_report of the batch. The rest
+             are timings in seconds: 'read' and 'process' are the total time
+             spent on each, 'wait' is the time processing sat idle waiting
+             for a file and 'wall' is the elapsed time. Without prefetching
+             'wait' would equal 'read'; 'overlap' is the read time hidden
+             behind processing.
+    """
+    results = dict()
+    failed = dict()
+    reports = dict()
+    timing = {'process': 0.0}
+    start = time.perf_counter()
+    with Prefetcher(files, max_files, max_bytes, reader,
+                    skip_errors=True) as recordings:
+        for file, raw in recordings:
+            process_start = time.perf_counter()
+            try:
+                if qc:
+                    report = signal_quality(raw)
+                    reports[file] = report
+                    # Unusable recordings are only reported
+                    if is_usable(report, short_chs):
+                        processed = process_fnirs(drop_failed(raw, report),
+                                                  short_chs, **kwargs)
+                        processed.attrs['quality'] = report
+                        results[file] = processed
+                else:
+                    results[file] = process_fnirs(raw, short_chs, **kwargs)
+            except Exception as e:
+                failed[file] = e
+            timing['process'] += time.perf_counter() - process_start
+
+    timing['wall'] = time.perf_counter() - start
+    timing['read'] = recordings.stats['read']
+    timing['wait'] = recordings.stats['wait']
+    timing['overlap'] = timing['read'] - timing['wait']
+    # Keep the failures in the order of the files
+    failed.update(recordings.errors)
+    timing['failed'] = {file: failed[file] for file in files if file in failed}
+    if qc:
+        timing['quality'] = quality_report(reports, short_chs)
+
+    return results, timing
@@ -0,0 +1,97 @@
+# Author: William Liu <liwi@ohsu.edu>
+
+import pandas as pd
+import numpy as np
+
+
+def sliding_connectivity(df: pd.DataFrame, window: int, step=1) -> dict:
+    """
+    Channel x channel Pearson correlation over sliding windows.
+
+    Window sums of x and of the products x_i * x_j are taken as differences
+    of cumulative sums, so the cost is linear in the number of samples and
+    does not grow with the window length.
+
+    :param df: dataframe of fnirs data, e.g. one segment from create_segments
+    :param window: window length in samples
+    :param step: number of samples between window starts
+    :return: dict with the channel labels ('channels'), the sample number at
+             the start of each window ('starts') and the correlation matrices
+             ('correlation', shape (n_windows, n_channels, n_channels))
+    """
+    if type(df) != pd.DataFrame:
+        raise TypeError(f"Must provide a dataframe, not {type(df)}")
+    if window < 2 or window > len(df):
+        raise ValueError(
+            f"Window must be between 2 and {len(df)} samples, not {window}."
+            )
+    if step < 1:
+        raise ValueError(f"Step must be a positive integer, not {step}.")
+
+    chs = [ch for ch in df.columns
+           if not ('Sample number' in ch or 'Event' in ch)]
+    values = np.array(df[chs], dtype=np.float64)
+    # Centre to limit cancellation error in the cumulative sums
+    values -= values.mean(axis=0)
+
+    n_samples, n_chs = values.shape
+    cum = np.zeros((n_samples + 1, n_chs))
+    np.cumsum(values, axis=0, out=cum[1:])
+    cum_prod = np.zeros((n_samples + 1, n_chs, n_chs))
+    np.cumsum(values[:, :, np.newaxis] * values[:, np.newaxis, :], axis=0,
+              out=cum_prod[1:])
+
+    starts = np.arange(0, n_samples - window + 1, step)
+    ends = starts + window
+    sums = cum[ends] - cum[starts]
+    sum_prods = cum_prod[ends] - cum_prod[starts]
+
+    cov = sum_prods - sums[:, :, np.newaxis] * sums[:, np.newaxis, :] / window
+    var = np.clip(np.diagonal(cov, axis1=1, axis2=2), 0, None)
+    scale = np.sqrt(var[:, :, np.newaxis] * var[:, np.newaxis, :])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        corr = np.clip(cov / scale, -1, 1)
+
+    if 'Sample number' in df.columns:
+        sample_numbers = np.array(df['Sample number'])[starts]
+    else:
+        sample_numbers = np.array(df.index)[starts]
+
+    return {'channels': chs, 'starts': sample_numbers, 'correlation': corr}
+
+
+def segment_connectivity(segments: dict, window: int, step=1) -> dict:
+    """
+    Run sliding_connectivity on every segment from create_segments.
+
+    :param segments: dict of segment name to dataframe
+    :param window: window length in samples
+    :param step: number of samples between window starts
+    :return: dict of segment name to sliding_connectivity output
+    """
+    return {seg: sliding_connectivity(df, window, step)
+            for seg, df in segments.items()}
+
+
+def interhemispheric_connectivity(connectivity: dict) -> pd.DataFrame:
+    """
+    Mean correlation between right (Rx1) and left (Rx2) hemisphere channels
+    of the same chromophore, for each window.
+
+    :param connectivity: output of sliding_connectivity
+    :return: dataframe indexed by window start with one column per chromophore
+    """
+    chs = connectivity['channels']
+    corr = connectivity['correlation']
+    data_as_dict = dict()
+    for chromophore in ['O2Hb', 'HHb', 'HbT', 'HbDiff']:
+        right = [i for i, ch in enumerate(chs)
+                 if ch.startswith('Rx1-') and ch.endswith(' ' + chromophore)]
+        left = [i for i, ch in enumerate(chs)
+                if ch.startswith('Rx2-') and ch.endswith(' ' + chromophore)]
+        if not right or not left:
+            continue
+        pairs = corr[:, right][:, :, left]
+        data_as_dict[chromophore] = pairs.mean(axis=(1, 2))
+
+    return pd.DataFrame(data=data_as_dict, index=connectivity['starts'])
@@ -3,11 +3,12 @@
 import pandas as pd
 
 
-def create_segments(df: pd.DataFrame) -> dict:
+def create_segments(df: pd.DataFrame, split=0.5) -> dict:
     """
     Split trial into segments based on 'Event' markers.
 
     :param df: dataframe of processed fnirs
+    :param split: fraction of the walking segment assigned to the early phase
     :return: dict with keys as individual segments and values
              as dataframes with fnirs data for given segment
     """
@@ -32,7 +33,7 @@ def create_segments(df: pd.DataFrame) -> dict:
     start = events.index[1]
     end = events.index[2]
     gap = end - start
-    mid = gap // 2
+    mid = int(gap * split)
     mid += start
     early = df.iloc[start:mid]
     late = df.iloc[mid:end]
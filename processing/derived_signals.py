@@ -0,0 +1,41 @@
+# Author: William Liu <liwi@ohsu.edu>
+
+import pandas as pd
+import numpy as np
+
+
+def derived_signals(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add total (HbT = O2Hb + HHb) and differential (HbDiff = O2Hb - HHb)
+    hemoglobin for every channel that has both chromophores.
+
+    :param df: dataframe of fnirs data, e.g. output of process_fnirs
+    :return: copy of the dataframe with ' HbT' and ' HbDiff' channels added
+             before the 'Event' column
+    """
+    if type(df) != pd.DataFrame:
+        raise TypeError(f"Must provide a dataframe, not {type(df)}")
+
+    df_copy = df.copy()
+    oxy_chs = list(df_copy.filter(regex=' O2Hb$').columns)
+    names = [ch[:-len(' O2Hb')] for ch in oxy_chs]
+    dxy_chs = [name + ' HHb' for name in names]
+    missing = [ch for ch in dxy_chs if ch not in df_copy.columns]
+    if missing:
+        raise KeyError(f"Could not find matching HHb channels: {missing}")
+
+    # Whole-array operations over all channels
+    oxy = np.array(df_copy[oxy_chs], dtype=np.float64)
+    dxy = np.array(df_copy[dxy_chs], dtype=np.float64)
+    total = pd.DataFrame(data=oxy + dxy, index=df_copy.index,
+                         columns=[name + ' HbT' for name in names])
+    diff = pd.DataFrame(data=oxy - dxy, index=df_copy.index,
+                        columns=[name + ' HbDiff' for name in names])
+
+    # Keep 'Event' as the last column, as in process_fnirs output
+    data_chs = [ch for ch in df_copy.columns if ch != 'Event']
+    parts = [df_copy[data_chs], total, diff]
+    if 'Event' in df_copy.columns:
+        parts.append(df_copy[['Event']])
+
+    return pd.concat(parts, axis=1)
@@ -2,13 +2,12 @@
 
 import pandas as pd
 import numpy as np
-import scipy.signal as signal
 
 
 def fir_filter(data: pd.DataFrame, order=1000, Wn=[0.01, 0.1],
                window='hamming', pass_zero='bandpass', fs=50) -> pd.DataFrame:
-    taps = order + 1
-    filt = signal.firwin(taps, Wn, window=window, pass_zero=pass_zero, fs=fs)
+    import scipy.signal as signal
+    filt = _design_fir(order, Wn, window, pass_zero, fs)
 
     # Apply the filter
     filtered_df = data.copy()
@@ -17,3 +16,10 @@ def fir_filter(data: pd.DataFrame, order=1000, Wn=[0.01, 0.1],
         filtered_df[ch] = signal.filtfilt(filt, [1.0], ch_asarray)
 
     return filtered_df
+
+
+def _design_fir(order, Wn, window, pass_zero, fs) -> np.ndarray:
+    """Return the coefficients of a linear phase FIR filter of given order."""
+    import scipy.signal as signal
+    taps = order + 1
+    return signal.firwin(taps, Wn, window=window, pass_zero=pass_zero, fs=fs)
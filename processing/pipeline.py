@@ -0,0 +1,321 @@
+# Author: William Liu <liwi@ohsu.edu>
+
+import collections
+import dataclasses
+import hashlib
+import inspect
+import pandas as pd
+import numpy as np
+from .process import _transform_data
+from .ssc_regression import ssc_regression
+from .tddr import _tddr
+from .filter import _design_fir
+from .baseline import baseline_subtraction
+
+
+_Stage = collections.namedtuple('_Stage', ['name', 'builder', 'per_channel'])
+
+# Registry of available stages, keyed by the name used in configs
+STAGES = dict()
+
+
+def register_stage(name: str, per_channel=False):
+    """
+    Decorator that adds a stage builder to the registry.
+
+    The builder is called as builder(context, **params) when the pipeline
+    runs. context is a dict with the short channel data ('short'), the event
+    rows ('events') and the current sample rate ('sample_rate'). A per-channel
+    builder returns a function mapping one channel (a 1-D array) to its
+    result, which lets adjacent per-channel stages share one pass over the
+    data. Any other builder returns a function mapping the dataframe of long
+    channels to a new dataframe.
+
+    :param name: name of the stage in pipeline configs
+    :param per_channel: True if the stage treats every channel independently
+    """
+    def decorator(builder):
+        STAGES[name] = _Stage(name, builder, per_channel)
+        return builder
+
+    return decorator
+
+
+@register_stage('ssc')
+def _ssc_stage(context):
+    return lambda df: ssc_regression(df, context['short'])
+
+
+@register_stage('tddr', per_channel=True)
+def _tddr_stage(context, tune=4.685):
+    sample_rate = context['sample_rate']
+    return lambda values: _tddr(values, sample_rate, tune)
+
+
+@register_stage('fir', per_channel=True)
+def _fir_stage(context, order=1000, Wn=[0.01, 0.1], window='hamming',
+               pass_zero='bandpass', fs=None):
+    import scipy.signal as signal
+    # Filter at the current sample rate unless one is given explicitly
+    if fs is None:
+        fs = context['sample_rate']
+    filt = _design_fir(order, list(Wn), window, pass_zero, fs)
+    return lambda values: signal.filtfilt(filt, [1.0], values)
+
+
+@register_stage('baseline')
+def _baseline_stage(context):
+    return lambda df: baseline_subtraction(df, context['events'])
+
+
+@register_stage('decimate')
+def _decimate_stage(context, factor=2):
+    import scipy.signal as signal
+    # Later stages run at the reduced sample rate
+    context['sample_rate'] = context['sample_rate'] / factor
+
+    def decimate(df):
+        values = signal.decimate(np.array(df, dtype=np.float64), factor,
+                                 axis=0, zero_phase=True)
+        return pd.DataFrame(data=values, index=df.index[::factor],
+                            columns=df.columns)
+
+    return decimate
+
+
+@dataclasses.dataclass(frozen=True)
+class ExecutionPlan:
+    """
+    Ordered steps of a pipeline. Each step is a tuple of (name, params)
+    stages run together; a step with several stages is a fused per-channel
+    pass. Params are stored as sorted (key, value) tuples so plans are
+    hashable and compare equal when their configs do.
+    """
+    steps: tuple
+    outputs: tuple
+
+    @property
+    def stages(self) -> tuple:
+        """All stages of the plan, in order."""
+        return tuple(stage for step in self.steps for stage in step)
+
+    @property
+    def key(self) -> str:
+        """
+        Stable hex digest of the stages and their parameters, suitable for
+        keying results across runs. Fusion and outputs do not change the
+        processed data, so they are not part of the key.
+        """
+        return hashlib.sha1(repr(self.stages).encode()).hexdigest()
+
+
+class Pipeline:
+    """
+    Processing pipeline built from a declarative config.
+
+    The config is a dict (or YAML file) such as
+
+        stages:
+          - ssc
+          - tddr: {tune: 4.685}
+          - fir: {order: 1000, Wn: [0.01, 0.1]}
+          - baseline
+        outputs: [tddr, fir]
+
+    Each stage is a name from STAGES, optionally mapped to its parameters.
+    Parameters are bound against the stage signature, so unknown names are
+    rejected and defaults are recorded in the plan. outputs lists the
+    intermediate results to keep ('raw' is the long channel data before any
+    stage); stages after the last requested output are not run.
+    """
+    def __init__(self, stages: list, outputs=None):
+        self.stages = tuple(_bind(name, params) for name, params in stages)
+        names = [name for name, _ in self.stages]
+        duplicates = {name for name in names if names.count(name) > 1}
+        if duplicates:
+            raise ValueError(f"Stages can only be used once: {duplicates}")
+
+        self.outputs = tuple(outputs or ())
+        unknown = [out for out in self.outputs
+                   if out not in names and out != 'raw']
+        if unknown:
+            raise KeyError(f"Requested outputs are not stages: {unknown}")
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """
+        Create a pipeline from a config dict with 'stages' and optionally
+        'outputs'.
+        """
+        stages = list()
+        for entry in config['stages']:
+            if isinstance(entry, str):
+                stages.append((entry, dict()))
+            elif isinstance(entry, dict) and len(entry) == 1:
+                name, params = next(iter(entry.items()))
+                stages.append((name, params or dict()))
+            else:
+                raise ValueError(f"Could not parse stage entry: {entry}")
+
+        return cls(stages, config.get('outputs'))
+
+    @classmethod
+    def from_yaml(cls, file_path: str):
+        """Create a pipeline from a YAML config file."""
+        try:
+            import yaml
+        except ImportError as e:
+            raise ImportError(
+                "Reading pipeline configs from YAML requires PyYAML."
+                ) from e
+
+        with open(file_path, 'r') as f:
+            config = yaml.safe_load(f)
+
+        return cls.from_config(config)
+
+    def plan(self) -> ExecutionPlan:
+        """
+        Build the execution plan: drop stages whose output is never used and
+        fuse runs of adjacent per-channel stages into single steps. A fused
+        step is ended early at a requested output so it can be stored.
+        """
+        stages = list(self.stages)
+        requested = [out for out in self.outputs if out != 'raw']
+        if requested:
+            names = [name for name, _ in stages]
+            last = max(names.index(out) for out in requested)
+            stages = stages[:(last + 1)]
+
+        steps = list()
+        current = list()
+        for name, params in stages:
+            if STAGES[name].per_channel:
+                current.append((name, params))
+                if name in self.outputs:
+                    steps.append(tuple(current))
+                    current = list()
+            else:
+                if current:
+                    steps.append(tuple(current))
+                    current = list()
+                steps.append(((name, params),))
+        if current:
+            steps.append(tuple(current))
+
+        return ExecutionPlan(tuple(steps), self.outputs)
+
+    def run(self, data: dict, short_chs: list) -> pd.DataFrame:
+        """
+        Run the pipeline on one recording.
+
+        :param data: dictionary with raw data (a dataframe) and metadata
+        :param short_chs: list of the short (reference) channels
+        :return: dataframe of processed fNIRS data, formatted like the
+                 output of process_fnirs
+        """
+        plan = self.plan()
+        long_data, context = _prepare(data, short_chs)
+        for step in plan.steps:
+            long_data = _run_step(step, long_data, context)
+
+        return _finalize(long_data, context['events'])
+
+    def run_with_outputs(self, data: dict, short_chs: list) -> dict:
+        """
+        Run the pipeline and keep the requested intermediate results.
+
+        :param data: dictionary with raw data (a dataframe) and metadata
+        :param short_chs: list of the short (reference) channels
+        :return: dict of output name to dataframe, each formatted like the
+                 output of process_fnirs
+        """
+        plan = self.plan()
+        long_data, context = _prepare(data, short_chs)
+        results = dict()
+        if 'raw' in plan.outputs:
+            results['raw'] = _finalize(long_data, context['events'])
+        for step in plan.steps:
+            long_data = _run_step(step, long_data, context)
+            name = step[-1][0]
+            if name in plan.outputs:
+                results[name] = _finalize(long_data, context['events'])
+
+        return results
+
+
+def _bind(name: str, params: dict) -> tuple:
+    """
+    Bind params to the stage builder signature and return the stage as
+    (name, frozen params), with defaults filled in.
+    """
+    if name not in STAGES:
+        raise KeyError(f"Unknown stage {name}. Expected one of {list(STAGES)}")
+
+    sig = inspect.signature(STAGES[name].builder)
+    try:
+        bound = sig.bind(None, **params)
+    except TypeError as e:
+        raise TypeError(f"Invalid parameters for stage {name}: {e}") from e
+    bound.apply_defaults()
+    arguments = dict(bound.arguments)
+    arguments.pop('context')
+
+    return (name, _freeze(arguments))
+
+
+def _freeze(value):
+    """Convert params to nested tuples so they are hashable."""
+    if isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    return value
+
+
+def _prepare(data: dict, short_chs: list):
+    """Split the raw recording and set up the stage context."""
+    raw = data['data'].copy()
+    metadata = data['metadata'].copy()
+    sample_rate = int(float(metadata['Datafile sample rate']))
+    short_data, long_data, events = _transform_data(raw, metadata, short_chs)
+    context = {'short': short_data, 'events': events,
+               'sample_rate': sample_rate}
+
+    return long_data, context
+
+
+def _run_step(step: tuple, df: pd.DataFrame, context: dict) -> pd.DataFrame:
+    """Run one plan step on the dataframe of long channels."""
+    functions = [STAGES[name].builder(context, **dict(params))
+                 for name, params in step]
+    if not STAGES[step[0][0]].per_channel:
+        return functions[0](df)
+
+    # Fused per-channel stages: a single pass over the channels
+    processed_df = df.copy()
+    for ch in list(processed_df.columns):
+        ch_asarray = np.array(processed_df[ch], dtype=np.float64)
+        for function in functions:
+            ch_asarray = function(ch_asarray)
+        processed_df[ch] = ch_asarray
+
+    return processed_df
+
+
+def _finalize(df: pd.DataFrame, events: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add the event column and the 'Sample number' column, as in
+    process_fnirs. Events are moved to the nearest remaining sample if the
+    data were decimated.
+    """
+    finalized = df.copy()
+    event_col = pd.Series(np.nan, index=finalized.index,
+                          dtype=events['Event'].dtype)
+    positions = finalized.index.get_indexer(events.index, method='nearest')
+    event_col.iloc[positions] = np.array(events['Event'])
+    finalized.insert(len(finalized.columns), 'Event', event_col)
+    finalized.reset_index(inplace=True)
+    finalized.rename(columns={'index': 'Sample number'}, inplace=True)
+
+    return finalized
@@ -4,27 +4,47 @@ from .ssc_regression import ssc_regression
 from .tddr import tddr
 from .filter import fir_filter
 from .baseline import baseline_subtraction
+from .quality import signal_quality, is_usable, drop_failed
 import pandas as pd
 import numpy as np
 import re
 import os
 
 
-def process_fnirs(data: dict, short_chs: list):
+def process_fnirs(data: dict, short_chs: list, qc=False):
     """
     Helper method to run the processing algorithms.
 
     :param data: dictionary with raw data (a dataframe) and metadata (a dict)
     :param short_chs: list of the short (reference) channels
+    :param qc: if True, screen the raw data with signal_quality first. Long
+               channels that fail are dropped, so they are also left out of
+               average_channels, and unusable recordings raise a ValueError
+               before any processing is done. The report is stored in
+               the 'quality' entry of the returned dataframe's attrs. For
+               batches, process_files(qc=True) skips unusable recordings
+               instead.
     :return: dataframe of processed fNIRS data
     """
+    report = None
+    if qc:
+        report = signal_quality(data)
+        if not is_usable(report, short_chs):
+            raise ValueError(
+                f"{data['metadata']['Export file']} failed quality control. "
+                f"Failing channels: {list(report.index[~report['Pass']])}"
+                )
+        data = drop_failed(data, report)
     raw = data['data'].copy()
     metadata = data['metadata'].copy()
     sample_rate = int(float(metadata['Datafile sample rate']))
     short_data, long_data, events = _transform_data(raw, metadata, short_chs)
     short_channel_corrected = ssc_regression(long_data, short_data)
     tddr_corrected = tddr(short_channel_corrected, sample_rate)
-    filtered = fir_filter(tddr_corrected, sample_rate)
+    # The filter order has always been bound to the sample rate here (and fs
+    # left at its default). Kept as is so existing results are reproducible;
+    # use processing.pipeline to choose the filter parameters explicitly.
+    filtered = fir_filter(tddr_corrected, order=sample_rate)
     baseline = baseline_subtraction(filtered, events)
     # Add event column to processed dataframe
     baseline.insert(len(baseline.columns), 'Event', events['Event'])
@@ -32,6 +52,8 @@ def process_fnirs(data: dict, short_chs: list):
     # because it refers to the sample number.
     baseline.reset_index(inplace=True)
     baseline.rename(columns={'index': 'Sample number'}, inplace=True)
+    if report is not None:
+        baseline.attrs['quality'] = report
 
     return baseline
 
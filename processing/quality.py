@@ -0,0 +1,188 @@
+# Author: William Liu <liwi@ohsu.edu>
+
+import pandas as pd
+import numpy as np
+
+
+def signal_quality(data: dict, sci_threshold=0.5, motion_threshold=0.05,
+                   flat_threshold=0.1, saturation_threshold=0.01,
+                   cardiac_band=[0.5, 2.5]) -> pd.DataFrame:
+    """
+    Screen the raw recording for bad channels before any processing.
+
+    Metrics are computed for all channels at once:
+    - SCI: scalp coupling index, the absolute correlation of O2Hb and HHb in
+      the cardiac band. A coupled optode shows a shared heartbeat.
+    - Motion: fraction of samples whose temporal derivative is more than 5
+      robust standard deviations from the median derivative.
+    - Flat: longest run of identical consecutive samples, as a fraction of
+      the recording.
+    - Saturated: fraction of samples stuck at the channel's minimum or
+      maximum value.
+    Metrics other than SCI take the worse of the two chromophores.
+
+    Pollonini L. et al. (2014). Auditory cortex activation to natural speech
+    and simulated cochlear implant speech measured with functional
+    near-infrared spectroscopy. Hearing Research, 309, 84-93.
+
+    :param data: dictionary with raw data (a dataframe) and metadata (a dict),
+                 as returned by fnirs_io.read_raw
+    :param sci_threshold: minimum SCI for a channel to pass
+    :param motion_threshold: maximum motion fraction for a channel to pass
+    :param flat_threshold: maximum flat fraction for a channel to pass
+    :param saturation_threshold: maximum saturated fraction to pass
+    :param cardiac_band: pass band (Hz) used for the SCI
+    :return: dataframe indexed by channel (e.g. 'Rx1-Tx1') with one column
+             per metric and a boolean 'Pass' column
+    """
+    df = data['data']
+    fs = int(float(data['metadata']['Datafile sample rate']))
+
+    oxy_chs = list(df.filter(regex=' O2Hb$').columns)
+    names = [ch.rsplit(' ', 1)[0] for ch in oxy_chs]
+    dxy_chs = [name + ' HHb' for name in names]
+    missing = [ch for ch in dxy_chs if ch not in df.columns]
+    if missing:
+        raise KeyError(f"Could not find matching HHb channels: {missing}")
+
+    oxy = np.array(df[oxy_chs], dtype=np.float64)
+    dxy = np.array(df[dxy_chs], dtype=np.float64)
+    both = np.concatenate([oxy, dxy], axis=1)
+    n_chs = len(names)
+
+    sci = _scalp_coupling_index(oxy, dxy, fs, cardiac_band)
+    motion = _motion_fraction(both)
+    flat = _longest_flat_run(both) / len(both)
+    saturated = _saturated_fraction(both)
+
+    report = pd.DataFrame(
+        data={
+            'SCI': sci,
+            'Motion': np.maximum(motion[:n_chs], motion[n_chs:]),
+            'Flat': np.maximum(flat[:n_chs], flat[n_chs:]),
+            'Saturated': np.maximum(saturated[:n_chs], saturated[n_chs:])
+        },
+        index=pd.Index(names, name='Channel')
+        )
+    report['Pass'] = (
+        (report['SCI'] >= sci_threshold)
+        & (report['Motion'] <= motion_threshold)
+        & (report['Flat'] <= flat_threshold)
+        & (report['Saturated'] <= saturation_threshold)
+        )
+
+    return report
+
+
+def is_usable(report: pd.DataFrame, short_chs: list, min_fraction=0.5):
+    """
+    Decide whether a recording is worth processing. All short channels must
+    pass, because every long channel is regressed on one of them, and at
+    least min_fraction of the long channels must pass.
+
+    :param report: output of signal_quality
+    :param short_chs: list of the short (reference) channels
+    :param min_fraction: minimum fraction of passing long channels
+    :return: True if the recording can be processed
+    """
+    is_short = report.index.isin(short_chs)
+    if not report.loc[is_short, 'Pass'].all():
+        return False
+    long_pass = report.loc[~is_short, 'Pass']
+    if len(long_pass) == 0:
+        return False
+
+    return long_pass.mean() >= min_fraction
+
+
+def drop_failed(data: dict, report: pd.DataFrame) -> dict:
+    """
+    Remove the channels that failed signal_quality from a raw recording.
+
+    :param data: dictionary with raw data (a dataframe) and metadata (a dict)
+    :param report: output of signal_quality
+    :return: copy of data without the O2Hb and HHb columns of failed channels
+    """
+    failed = list(report.index[~report['Pass']])
+    df = data['data']
+    df = df.drop(columns=[ch for ch in df.columns
+                          if ch.rsplit(' ', 1)[0] in failed])
+
+    return {'metadata': data['metadata'].copy(), 'data': df}
+
+
+def quality_report(reports: dict, short_chs: list) -> pd.DataFrame:
+    """
+    Combine the signal_quality reports of a batch of recordings. The reports
+    are computed once per file while the batch runs, e.g. by process_files
+    or as the 'quality' attrs of process_fnirs(qc=True) output, so the raw
+    recordings do not need to be kept.
+
+    :param reports: dict of file path to the output of signal_quality
+    :param short_chs: list of the short (reference) channels
+    :return: dataframe indexed by (file, channel) with the metrics, the
+             channel 'Pass' flag and the file-level 'Usable' flag
+    """
+    flagged = dict()
+    for file, report in reports.items():
+        report = report.copy()
+        report['Usable'] = is_usable(report, short_chs)
+        flagged[file] = report
+
+    return pd.concat(flagged, names=['File'])
+
+
+def _scalp_coupling_index(oxy: np.ndarray, dxy: np.ndarray, fs: int,
+                          band: list) -> np.ndarray:
+    """Column-wise correlation of O2Hb and HHb in the cardiac band."""
+    from scipy.signal import butter, sosfiltfilt
+    # Keep the upper edge below Nyquist for low sample rate recordings
+    high = min(band[1], 0.45 * fs)
+    sos = butter(N=4, Wn=[band[0], high], btype='bandpass', output='sos',
+                 fs=fs)
+    oxy_f = sosfiltfilt(sos, oxy, axis=0)
+    dxy_f = sosfiltfilt(sos, dxy, axis=0)
+    oxy_f -= oxy_f.mean(axis=0)
+    dxy_f -= dxy_f.mean(axis=0)
+
+    num = np.sum(oxy_f * dxy_f, axis=0)
+    den = np.sqrt(np.sum(oxy_f ** 2, axis=0) * np.sum(dxy_f ** 2, axis=0))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sci = np.abs(num / den)
+
+    # A flat channel has no cardiac signal at all
+    return np.where(den > 0, sci, 0.0)
+
+
+def _motion_fraction(values: np.ndarray, k=5) -> np.ndarray:
+    """Fraction of derivative samples more than k robust SDs from median."""
+    deriv = np.diff(values, axis=0)
+    median = np.median(deriv, axis=0)
+    mad = 1.4826 * np.median(np.abs(deriv - median), axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        outliers = np.abs(deriv - median) > k * mad
+
+    return outliers.mean(axis=0)
+
+
+def _longest_flat_run(values: np.ndarray) -> np.ndarray:
+    """Length of the longest run of identical consecutive samples."""
+    same = np.diff(values, axis=0) == 0
+    count = np.cumsum(same, axis=0)
+    # Count at the most recent change, carried forward
+    at_change = np.maximum.accumulate(np.where(same, 0, count), axis=0)
+    runs = count - at_change
+
+    # A run of n repeated differences spans n + 1 samples
+    longest = runs.max(axis=0)
+    return np.where(longest > 0, longest + 1, 0)
+
+
+def _saturated_fraction(values: np.ndarray) -> np.ndarray:
+    """Fraction of samples equal to the channel minimum or maximum."""
+    at_max = values == values.max(axis=0)
+    at_min = values == values.min(axis=0)
+    saturated = (at_max | at_min).sum(axis=0)
+
+    # A healthy channel touches each extreme once
+    return np.where(saturated > 2, saturated, 0) / len(values)
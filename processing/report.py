@@ -0,0 +1,201 @@
+# Author: William Liu <liwi@ohsu.edu>
+
+import concurrent.futures
+import os
+import numpy as np
+from fnirs_io import read_raw
+from .pipeline import Pipeline
+
+
+def minmax_downsample(values: np.ndarray, n_buckets: int) -> np.ndarray:
+    """
+    Indexes of the minimum and maximum of every bucket, for all channels at
+    once. With one bucket per pixel the plotted envelope is identical to the
+    full-rate trace.
+
+    :param values: array of shape (n_samples, n_channels)
+    :param n_buckets: number of buckets, e.g. the plot width in pixels
+    :return: array of sample indexes, shape (2 * n_buckets, n_channels),
+             in increasing order for each channel. If there are no more than
+             2 * n_buckets samples, all of them are kept and the shape is
+             (n_samples, n_channels).
+    """
+    n_samples, n_chs = values.shape
+    if 2 * n_buckets >= n_samples:
+        return np.repeat(np.arange(n_samples)[:, np.newaxis], n_chs, axis=1)
+
+    size = -(-n_samples // n_buckets)
+    # Pad with the last sample so the data reshape into equal buckets
+    padded = np.pad(values, ((0, size * n_buckets - n_samples), (0, 0)),
+                    mode='edge')
+    buckets = padded.reshape(n_buckets, size, n_chs)
+    offsets = (np.arange(n_buckets) * size)[:, np.newaxis]
+    idx_min = np.minimum(buckets.argmin(axis=1) + offsets, n_samples - 1)
+    idx_max = np.minimum(buckets.argmax(axis=1) + offsets, n_samples - 1)
+
+    # Keep the two points of each bucket in time order
+    first = np.minimum(idx_min, idx_max)
+    second = np.maximum(idx_min, idx_max)
+
+    return np.stack([first, second], axis=1).reshape(2 * n_buckets, n_chs)
+
+
+def lttb_downsample(x: np.ndarray, values: np.ndarray,
+                    n_out: int) -> np.ndarray:
+    """
+    Largest-Triangle-Three-Buckets downsampling. The loop runs over output
+    points; every step is computed for all channels at once.
+
+    Steinarsson S. (2013). Downsampling Time Series for Visual
+    Representation. MSc thesis, University of Iceland.
+
+    :param x: array of sample times, shape (n_samples,)
+    :param values: array of shape (n_samples, n_channels)
+    :param n_out: number of points to keep, at least 3
+    :return: array of sample indexes, shape (n_out, n_channels). If n_out is
+             not less than n_samples, or less than 3, all samples are kept
+             and the shape is (n_samples, n_channels).
+    """
+    n_samples, n_chs = values.shape
+    if n_out >= n_samples or n_out < 3:
+        return np.repeat(np.arange(n_samples)[:, np.newaxis], n_chs, axis=1)
+
+    every = (n_samples - 2) / (n_out - 2)
+    chs = np.arange(n_chs)
+    selected = np.zeros((n_out, n_chs), dtype=np.int64)
+    selected[-1] = n_samples - 1
+    previous = selected[0]
+
+    for i in range(n_out - 2):
+        start = int(i * every) + 1
+        end = int((i + 1) * every) + 1
+        next_end = min(int((i + 2) * every) + 1, n_samples)
+
+        # Average point of the next bucket (the last point for the last one)
+        if end < next_end:
+            avg_x = x[end:next_end].mean()
+            avg_y = values[end:next_end].mean(axis=0)
+        else:
+            avg_x = x[-1]
+            avg_y = values[-1]
+
+        prev_x = x[previous]
+        prev_y = values[previous, chs]
+        bucket_x = x[start:end, np.newaxis]
+        bucket_y = values[start:end]
+        area = np.abs((prev_x - avg_x) * (bucket_y - prev_y)
+                      - (prev_x - bucket_x) * (avg_y - prev_y))
+        previous = start + area.argmax(axis=0)
+        selected[i + 1] = previous
+
+    return selected
+
+
+def render_page(stages: dict, file_path: str, title='', width=1600,
+                method='minmax'):
+    """
+    Render one static page comparing the processing stages of a recording.
+
+    Each stage is a row with O2Hb and HHb side by side, event markers drawn
+    as vertical lines. Traces are downsampled to the pixel width of the
+    plots before drawing, so the page is fast to render and small on disk.
+
+    :param stages: dict of stage name to dataframe, as returned by
+                   Pipeline.run_with_outputs
+    :param file_path: path of the image to write, e.g. a .png
+    :param title: title of the page
+    :param width: width of the page in pixels
+    :param method: 'minmax' or 'lttb'
+    """
+    if method not in ['minmax', 'lttb']:
+        raise ValueError(f"Method must be 'minmax' or 'lttb', not {method}")
+
+    # Render without a GUI backend, safe to use in worker processes
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+    dpi = 100
+    fig = Figure(figsize=(width / dpi, 2.5 * len(stages)), dpi=dpi)
+    FigureCanvasAgg(fig)
+    axes = fig.subplots(len(stages), 2, squeeze=False, sharex=True)
+    # Roughly one bucket per pixel column of each plot
+    n_points = max(3, width // 2)
+
+    for row, (name, df) in enumerate(stages.items()):
+        x = np.array(df['Sample number'], dtype=np.float64)
+        events = np.array(df.loc[df['Event'].notnull(), 'Sample number'])
+        for col, chromophore in enumerate(['O2Hb', 'HHb']):
+            ax = axes[row, col]
+            chs = [ch for ch in df.columns if ch.endswith(' ' + chromophore)]
+            values = np.array(df[chs], dtype=np.float64)
+            if method == 'minmax':
+                idx = minmax_downsample(values, n_points // 2)
+            else:
+                idx = lttb_downsample(x, values, n_points)
+            for i, ch in enumerate(chs):
+                ax.plot(x[idx[:, i]], values[idx[:, i], i], linewidth=0.6,
+                        label=ch.rsplit(' ', 1)[0])
+            for event in events:
+                ax.axvline(event, color='k', linestyle='--', linewidth=0.8)
+            ax.set_title(f'{name} {chromophore}', fontsize=9)
+        axes[row, 0].set_ylabel('Concentration change')
+
+    axes[0, 1].legend(fontsize=6, ncol=2, loc='upper right')
+    axes[-1, 0].set_xlabel('Sample number')
+    axes[-1, 1].set_xlabel('Sample number')
+    fig.suptitle(title)
+    fig.tight_layout()
+    fig.savefig(file_path)
+
+
+def generate_reports(files: list, short_chs: list, out_dir: str,
+                     config=None, processes=None, width=1600,
+                     method='minmax') -> list:
+    """
+    Write a QC page for every recording, in parallel across a process pool.
+
+    Each page shows the raw long channels and the output of every stage of
+    the pipeline. Without a config the stages and filter settings of
+    process_fnirs are used (SSC, TDDR, FIR).
+
+    :param files: paths of the recordings
+    :param short_chs: list of the short (reference) channels
+    :param out_dir: directory to write the pages to
+    :param config: optional pipeline config, see Pipeline.from_config
+    :param processes: number of worker processes, None to use all CPUs and
+                      1 to run in the current process
+    :param width: width of the pages in pixels
+    :param method: downsampling method, 'minmax' or 'lttb'
+    :return: list of the paths of the written pages
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    args = [(file, short_chs, out_dir, config, width, method)
+            for file in files]
+    if processes == 1:
+        return [_report_file(*arg) for arg in args]
+
+    with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+        futures = [executor.submit(_report_file, *arg) for arg in args]
+        return [future.result() for future in futures]
+
+
+def _report_file(file: str, short_chs: list, out_dir: str, config: dict,
+                 width: int, method: str) -> str:
+    """Process one recording and render its page."""
+    raw = read_raw(file)
+    if config is None:
+        # Same filter binding as process_fnirs
+        sample_rate = int(float(raw['metadata']['Datafile sample rate']))
+        config = {'stages': ['ssc', 'tddr',
+                             {'fir': {'order': sample_rate, 'fs': 50}}]}
+    config = dict(config)
+    stages = Pipeline.from_config(config).stages
+    config['outputs'] = ['raw'] + [name for name, _ in stages]
+
+    outputs = Pipeline.from_config(config).run_with_outputs(raw, short_chs)
+    name = os.path.splitext(os.path.basename(file))[0]
+    page = os.path.join(out_dir, name + '.png')
+    render_page(outputs, page, title=os.path.basename(file), width=width,
+                method=method)
+
+    return page
@@ -0,0 +1,360 @@
+# Author: William Liu <liwi@ohsu.edu>
+
+import datetime
+import hashlib
+import os
+import sqlite3
+import time
+import pandas as pd
+from fnirs_io import Prefetcher
+from .process import process_fnirs
+from .quality import signal_quality, is_usable, drop_failed
+from .create_segments import create_segments
+from .statistics import calculate_statistics, _file_names
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS recordings (
+    id INTEGER PRIMARY KEY,
+    file TEXT NOT NULL,
+    content_hash TEXT NOT NULL,
+    params_key TEXT NOT NULL,
+    processed_at TEXT NOT NULL,
+    duration REAL,
+    usable INTEGER NOT NULL,
+    UNIQUE (content_hash, params_key)
+);
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT NOT NULL,
+    recording_id INTEGER NOT NULL REFERENCES recordings (id),
+    linked_at TEXT NOT NULL,
+    PRIMARY KEY (path, recording_id)
+);
+CREATE TABLE IF NOT EXISTS quality (
+    recording_id INTEGER NOT NULL REFERENCES recordings (id),
+    channel TEXT NOT NULL,
+    sci REAL,
+    motion REAL,
+    flat REAL,
+    saturated REAL,
+    pass INTEGER
+);
+CREATE TABLE IF NOT EXISTS statistics (
+    recording_id INTEGER NOT NULL REFERENCES recordings (id),
+    segment TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    value REAL
+);
+CREATE INDEX IF NOT EXISTS statistics_lookup
+    ON statistics (segment, channel, metric);
+CREATE INDEX IF NOT EXISTS statistics_recording
+    ON statistics (recording_id);
+CREATE INDEX IF NOT EXISTS recordings_file
+    ON recordings (file, params_key);
+CREATE INDEX IF NOT EXISTS files_recording
+    ON files (recording_id);
+"""
+
+# Condition selecting, for each path and params, the recording the path was
+# linked to last. A file restored to earlier content is linked back to the
+# older recording, so this is not always the newest recording.
+_LATEST_LINK = """
+f.linked_at = (SELECT MAX(f2.linked_at) FROM files f2
+               JOIN recordings r2 ON r2.id = f2.recording_id
+               WHERE f2.path = f.path AND r2.params_key = r.params_key)
+"""
+
+
+class ResultsStore:
+    """
+    Local SQLite store of per-recording results.
+
+    Recordings are keyed by the hash of the input file content and the
+    processing parameters, so a cohort run only needs to process new or
+    changed files. The paths a recording was seen at are kept in a separate
+    table with the time each was last linked, so moved, renamed, copied or
+    restored files map to their current results. The
+    calculate_statistics rows are stored in long form
+    (segment, channel, metric, value) in an indexed table, together with the
+    quality control flags and the processing time of each recording.
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.connection.close()
+
+    def has(self, content_hash: str, params_key: str) -> bool:
+        """Check if a recording was already processed with these params."""
+        return self._recording_id(content_hash, params_key) is not None
+
+    def link(self, file: str, content_hash: str, params_key: str):
+        """
+        Record that an already processed recording was found at file, e.g.
+        after it was moved, renamed or copied.
+
+        :param file: path to data file
+        :param content_hash: hash of the file content, see file_hash
+        :param params_key: key of the processing parameters
+        """
+        recording_id = self._recording_id(content_hash, params_key)
+        if recording_id is None:
+            raise KeyError(f"No results stored for {file} with these params.")
+        with self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO files VALUES (?, ?, ?)",
+                (file, recording_id, datetime.datetime.now().isoformat())
+                )
+
+    def add(self, file: str, content_hash: str, params_key: str,
+            stats=None, quality=None, duration=None, usable=True):
+        """
+        Store the results of one recording, replacing any earlier results for
+        the same content and params.
+
+        :param file: path to data file
+        :param content_hash: hash of the file content, see file_hash
+        :param params_key: key of the processing parameters
+        :param stats: output of calculate_statistics, None if not processed
+        :param quality: output of signal_quality, if quality control was run
+        :param duration: processing time in seconds
+        :param usable: False if the recording failed quality control
+        """
+        with self.connection:
+            old = self.connection.execute(
+                "SELECT id FROM recordings WHERE content_hash = ? "
+                "AND params_key = ?", (content_hash, params_key)
+                ).fetchone()
+            now = datetime.datetime.now().isoformat()
+            links = dict()
+            if old is not None:
+                # Keep the paths the replaced results were found at
+                links.update(self.connection.execute(
+                    "SELECT path, linked_at FROM files WHERE recording_id = ?",
+                    old
+                    ))
+                self._delete(old[0])
+            links[file] = now
+
+            cursor = self.connection.execute(
+                "INSERT INTO recordings (file, content_hash, params_key, "
+                "processed_at, duration, usable) VALUES (?, ?, ?, ?, ?, ?)",
+                (file, content_hash, params_key, now, duration, int(usable))
+                )
+            recording_id = cursor.lastrowid
+            self.connection.executemany(
+                "INSERT INTO files VALUES (?, ?, ?)",
+                [(path, recording_id, linked_at)
+                 for path, linked_at in sorted(links.items())]
+                )
+
+            if quality is not None:
+                self.connection.executemany(
+                    "INSERT INTO quality VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [(recording_id, ch, float(row['SCI']),
+                      float(row['Motion']), float(row['Flat']),
+                      float(row['Saturated']), int(row['Pass']))
+                     for ch, row in quality.iterrows()]
+                    )
+
+            if stats is not None:
+                rows = list()
+                for label, value in stats.iloc[0].items():
+                    segment, channel, metric = _split_label(label)
+                    rows.append((recording_id, segment, channel, metric,
+                                 float(value)))
+                self.connection.executemany(
+                    "INSERT INTO statistics VALUES (?, ?, ?, ?, ?)", rows
+                    )
+
+    def query(self, params_key=None, segment=None, channel=None,
+              metric=None) -> pd.DataFrame:
+        """
+        Query the statistics of the recording each path was last linked to.
+
+        :param params_key: optional key of the processing parameters
+        :param segment: optional segment, e.g. 'Walking'
+        :param channel: optional channel, e.g. 'Rx1-Tx1 O2Hb' or 'grand oxy'
+        :param metric: optional metric, e.g. 'Mean'
+        :return: long dataframe with columns File, Segment, Channel, Metric,
+                 Value and Params
+        """
+        sql = (
+            "SELECT f.path, s.segment, s.channel, s.metric, s.value, "
+            "r.params_key FROM files f "
+            "JOIN recordings r ON r.id = f.recording_id "
+            "JOIN statistics s ON s.recording_id = r.id "
+            f"WHERE {_LATEST_LINK}"
+            )
+        args = list()
+        for column, value in [('r.params_key', params_key),
+                              ('s.segment', segment),
+                              ('s.channel', channel),
+                              ('s.metric', metric)]:
+            if value is not None:
+                sql += f" AND {column} = ?"
+                args.append(value)
+
+        return pd.read_sql_query(
+            sql, self.connection, params=args
+            ).rename(columns={'path': 'File', 'segment': 'Segment',
+                              'channel': 'Channel', 'metric': 'Metric',
+                              'value': 'Value', 'params_key': 'Params'})
+
+    def statistics(self, params_key: str, hashes=None) -> pd.DataFrame:
+        """
+        Rebuild the calculate_statistics table of the cohort.
+
+        Rows are indexed by file name, or by the full path if two files share
+        a name. Recordings that failed quality control have no row.
+
+        :param params_key: key of the processing parameters
+        :param hashes: optional dict of file path to content hash (see
+                       file_hash) of the files to include. Results are looked
+                       up by content, so moved or copied files are found.
+                       Without it, the results each stored path was last
+                       linked to are returned.
+        :return: dataframe with one row per file
+        """
+        if hashes is None:
+            targets = self.connection.execute(
+                "SELECT f.path, r.id FROM files f "
+                "JOIN recordings r ON r.id = f.recording_id "
+                f"WHERE r.params_key = ? AND {_LATEST_LINK} ORDER BY f.path",
+                (params_key,)
+                ).fetchall()
+        else:
+            targets = [(path, self._recording_id(content_hash, params_key))
+                       for path, content_hash in hashes.items()]
+            targets = [(path, rid) for path, rid in targets if rid is not None]
+
+        ids = sorted({rid for _, rid in targets})
+        long_df = pd.read_sql_query(
+            "SELECT recording_id, segment, channel, metric, value "
+            "FROM statistics WHERE recording_id IN "
+            f"({', '.join('?' * len(ids))})", self.connection, params=ids
+            )
+        long_df['Label'] = (
+            long_df['segment'] + ' ' + long_df['channel'] + ' '
+            + long_df['metric']
+            )
+        # Recording ids are unique, unlike file names
+        wide = long_df.pivot(index='recording_id', columns='Label',
+                             values='value')
+
+        ret_df = wide.reindex([rid for _, rid in targets])
+        ret_df.index = _file_names([path for path, _ in targets])
+        ret_df.index.name = None
+        ret_df.columns.name = None
+
+        return ret_df.dropna(how='all')
+
+    def _recording_id(self, content_hash: str, params_key: str):
+        row = self.connection.execute(
+            "SELECT id FROM recordings WHERE content_hash = ? "
+            "AND params_key = ?", (content_hash, params_key)
+            ).fetchone()
+
+        return None if row is None else row[0]
+
+    def _delete(self, recording_id: int):
+        for table in ['statistics', 'quality', 'files']:
+            self.connection.execute(
+                f"DELETE FROM {table} WHERE recording_id = ?", (recording_id,)
+                )
+        self.connection.execute(
+            "DELETE FROM recordings WHERE id = ?", (recording_id,)
+            )
+
+
+def file_hash(file_path: str) -> str:
+    """SHA-256 of the file content, read in blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def process_cohort(files: list, short_chs: list, store: ResultsStore,
+                   pipeline=None, qc=False) -> pd.DataFrame:
+    """
+    Process a cohort incrementally: recordings already in the store with the
+    same content and parameters are skipped, the rest are read (with
+    prefetching), processed and stored.
+
+    :param files: paths of the recordings
+    :param short_chs: list of the short (reference) channels
+    :param store: ResultsStore to read from and write to
+    :param pipeline: optional Pipeline to use instead of process_fnirs
+    :param qc: if True, skip recordings that fail quality control and leave
+               out failing channels, see signal_quality
+    :return: dataframe of statistics for all files, as in calculate_statistics
+    """
+    params_key = _params_key(short_chs, pipeline, qc)
+    hashes = {file: file_hash(file) for file in files}
+    pending = dict()
+    copies = list()
+    for file in files:
+        if hashes[file] in pending.values():
+            copies.append(file)
+        elif store.has(hashes[file], params_key):
+            # Already processed, possibly under another path
+            store.link(file, hashes[file], params_key)
+        else:
+            pending[file] = hashes[file]
+
+    with Prefetcher(list(pending)) as recordings:
+        for file, raw in recordings:
+            start = time.perf_counter()
+            report = None
+            if qc:
+                report = signal_quality(raw)
+                if not is_usable(report, short_chs):
+                    store.add(file, hashes[file], params_key, quality=report,
+                              duration=time.perf_counter() - start,
+                              usable=False)
+                    continue
+                raw = drop_failed(raw, report)
+
+            if pipeline is None:
+                processed = process_fnirs(raw, short_chs)
+            else:
+                processed = pipeline.run(raw, short_chs)
+            stats = calculate_statistics(create_segments(processed), file)
+            store.add(file, hashes[file], params_key, stats=stats,
+                      quality=report, duration=time.perf_counter() - start)
+
+    # Identical files in the cohort are processed once
+    for file in copies:
+        store.link(file, hashes[file], params_key)
+
+    return store.statistics(params_key, hashes)
+
+
+def _params_key(short_chs: list, pipeline, qc: bool) -> str:
+    """Key of everything besides the file content that changes results."""
+    if pipeline is None:
+        stages = 'process_fnirs'
+    else:
+        stages = pipeline.plan().key
+    params = repr((stages, sorted(short_chs), bool(qc)))
+
+    return hashlib.sha1(params.encode()).hexdigest()
+
+
+def _split_label(label: str) -> tuple:
+    """Split 'Walking Rx1-Tx1 O2Hb Mean' into segment, channel and metric."""
+    segment, rest = label.split(' ', 1)
+    channel, metric = rest.rsplit(' ', 1)
+
+    return segment, channel, metric
@@ -67,3 +67,12 @@ def detrended_mean(data):
     mean = math.fsum(diff) / len(diff)
 
     return mean
+
+
+def _file_names(paths: list) -> list:
+    """File names of the paths, or the full paths if names are not unique."""
+    names = [os.path.basename(path) for path in paths]
+    if len(set(names)) == len(names):
+        return names
+
+    return list(paths)
@@ -0,0 +1,129 @@
+# Author: William Liu <liwi@ohsu.edu>
+
+import concurrent.futures
+import itertools
+import pandas as pd
+from fnirs_io import read_raw
+from .pipeline import Pipeline, _freeze, _prepare, _run_step, _finalize
+from .create_segments import create_segments
+from .statistics import calculate_statistics, _file_names
+
+
+def sweep(files: list, short_chs: list, config: dict, grid: dict,
+          processes=None) -> pd.DataFrame:
+    """
+    Run a sensitivity analysis over a grid of processing parameters.
+
+    The grid maps 'stage.param' to a list of values, e.g.
+    {'tddr.tune': [4.685, 3.0], 'fir.order': [50, 1000],
+     'segments.split': [0.5, 0.33]}. 'segments.split' is passed on to
+    create_segments; every other key overrides a parameter of a stage in
+    config. All combinations are organised as a prefix tree over the stages,
+    so a stage shared by several combinations (e.g. TDDR feeding every filter
+    variant) is computed once per recording. Recordings are processed in
+    parallel across a process pool.
+
+    :param files: paths of the recordings to process
+    :param short_chs: list of the short (reference) channels
+    :param config: base pipeline config, see Pipeline.from_config
+    :param grid: dict of 'stage.param' to list of values
+    :param processes: number of worker processes, None to use all CPUs and
+                      1 to run in the current process
+    :return: dataframe of calculate_statistics metrics with one row per
+             parameter combination and file, indexed by the grid keys and
+             'File'. Files are named as in calculate_statistics, or by their
+             full path if two files share a name.
+    """
+    keys = list(grid)
+    for key in keys:
+        if len(key.split('.')) != 2:
+            raise ValueError(f"Grid keys must be 'stage.param', not {key}")
+
+    combos = [tuple(_freeze(value) for value in values)
+              for values in itertools.product(*grid.values())]
+    pipelines = [_override(config, keys, combo) for combo in combos]
+    splits = [dict(zip(keys, combo)).get('segments.split', 0.5)
+              for combo in combos]
+    tree = _build_tree(pipelines)
+
+    rows = list()
+    if processes == 1:
+        for file in files:
+            rows.extend(_sweep_file(file, short_chs, tree, splits, combos))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(processes) as executor:
+            futures = [executor.submit(_sweep_file, file, short_chs, tree,
+                                       splits, combos) for file in files]
+            for future in futures:
+                rows.extend(future.result())
+
+    names = dict(zip(files, _file_names(files)))
+    index = pd.MultiIndex.from_tuples([combo + (names[file],)
+                                       for combo, file, _ in rows],
+                                      names=keys + ['File'])
+    ret_df = pd.DataFrame([stats for _, _, stats in rows], index=index)
+
+    return ret_df
+
+
+def _override(config: dict, keys: list, combo: tuple) -> Pipeline:
+    """Return a pipeline with the stage parameters of a combination set."""
+    pipeline = Pipeline.from_config(config)
+    stages = [(name, dict(params)) for name, params in pipeline.stages]
+    names = [name for name, _ in stages]
+    for key, value in zip(keys, combo):
+        stage, param = key.split('.')
+        if stage == 'segments':
+            continue
+        if stage not in names:
+            raise KeyError(f"Stage {stage} is not in the pipeline config.")
+        stages[names.index(stage)][1][param] = value
+
+    return Pipeline(stages)
+
+
+def _build_tree(pipelines: list) -> dict:
+    """
+    Prefix tree of the stages of all pipelines. Each node maps a stage to
+    its child node; the key None holds the indexes of the pipelines that end
+    at that node.
+    """
+    tree = dict()
+    for idx, pipeline in enumerate(pipelines):
+        node = tree
+        for stage in pipeline.stages:
+            node = node.setdefault(stage, dict())
+        node.setdefault(None, list()).append(idx)
+
+    return tree
+
+
+def _sweep_file(file: str, short_chs: list, tree: dict, splits: list,
+                combos: list) -> list:
+    """Run all combinations on one recording, sharing common prefixes."""
+    long_data, context = _prepare(read_raw(file), short_chs)
+    stats = dict()
+    _run_tree(tree, long_data, context, file, splits, stats)
+
+    return [(combos[idx], file, stats[idx]) for idx in sorted(stats)]
+
+
+def _run_tree(node: dict, df: pd.DataFrame, context: dict, file: str,
+              splits: list, stats: dict):
+    """
+    Depth-first walk of the prefix tree, so only the intermediates along the
+    current path are held in memory. Statistics are calculated at the leaves
+    and only their row is kept.
+    """
+    for stage, child in node.items():
+        if stage is None:
+            finalized = _finalize(df, context['events'])
+            for idx in child:
+                segments = create_segments(finalized, splits[idx])
+                row = calculate_statistics(segments, file)
+                stats[idx] = row.iloc[0].to_dict()
+            continue
+        # Stages such as decimation update the context for their branch only
+        branch_context = dict(context)
+        result = _run_step((stage,), df, branch_context)
+        _run_tree(child, result, branch_context, file, splits, stats)
@@ -1,12 +1,11 @@
 # Author: William Liu <liwi@ohsu.edu>
 
 import numpy as np
-from scipy.signal import butter, sosfiltfilt
 import math
 import pandas as pd
 
 
-def tddr(data: pd.DataFrame, sample_rate: int) -> pd.DataFrame:
+def tddr(data: pd.DataFrame, sample_rate: int, tune=4.685) -> pd.DataFrame:
     """
     Apply Temporal Derivative Distribution Repair algorithm.
 
@@ -14,24 +13,30 @@ def tddr(data: pd.DataFrame, sample_rate: int) -> pd.DataFrame:
     Temporal Derivative Distribution Repair (TDDR): A motion correction
     method for fNIRS. NeuroImage, 184, 171-179.
     https://doi.org/10.1016/j.neuroimage.2018.09.025
+
+    :param data: dataframe of fNIRS data
+    :param sample_rate: sample rate of the data in Hz
+    :param tune: tuning constant of Tukey's biweight function
+    :return: dataframe of motion corrected fNIRS data
     """
     corrected_df = data.copy()
     chs = list(corrected_df.columns)
     for ch in chs:
         if corrected_df[ch].dtype == np.float64:
             ch_asarray = np.array(corrected_df[ch], dtype='float64')
-            corrected_df[ch] = _tddr(ch_asarray, sample_rate)
+            corrected_df[ch] = _tddr(ch_asarray, sample_rate, tune)
 
     return corrected_df
 
 
-def _tddr(data: np.array, sample_rate: int) -> np.array:
+def _tddr(data: np.array, sample_rate: int, tune=4.685) -> np.array:
     """
     Helper method to run the TDDR algorithm.
 
     Based on https://github.com/frankfishburn/TDDR with only some slight
     modifciations to ensure compatibility.
     """
+    from scipy.signal import butter, sosfiltfilt
     signal = np.array(data)
     if len(signal.shape) != 1:
         raise ValueError(f"""Length of shape of provided data is
@@ -48,7 +53,6 @@ def _tddr(data: np.array, sample_rate: int) -> np.array:
     signal_high = signal - signal_low
 
     # Initialize
-    tune = 4.685
     D = np.sqrt(np.finfo(signal.dtype).eps)
     mu = np.inf
     iter = 0
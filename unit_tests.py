@@ -5,8 +5,56 @@ from processing.process import _transform_data, process_fnirs
 from processing.ssc_regression import _find_short, ssc_regression
 from processing.average_channels import average_channels
 from processing.baseline import baseline_subtraction
+from processing.group_statistics import permutation_test, bootstrap_ci
+from processing.glm import design_matrix, glm_statistics
+from processing.derived_signals import derived_signals
+from processing.connectivity import (sliding_connectivity,
+                                     interhemispheric_connectivity)
+from processing.quality import signal_quality, is_usable, quality_report
+from processing.pipeline import Pipeline
+from processing.sweep import sweep, _override, _build_tree
+from processing.create_segments import create_segments
+from processing.statistics import calculate_statistics
+from processing.batch import process_files
+from fnirs_io.prefetch import Prefetcher
+from fnirs_io import _snirf
+from processing.report import (lttb_downsample, minmax_downsample,
+                               generate_reports)
+from processing.results_db import ResultsStore, process_cohort
+from scipy import stats
+from unittest import mock
 import numpy as np
+import importlib.util
 import math
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+def synthetic_raw(seed=0, fs=50, n=7500):
+    """Build a read_raw-style dict with a shared heartbeat and 3 events."""
+    rng = np.random.default_rng(seed)
+    t = np.arange(n) / fs
+    heartbeat = np.sin(2 * np.pi * 1.2 * t)
+    data = {'Sample number': np.arange(fs, n + fs)}
+    for rx, txs in [('Rx1', [1, 2, 3, 4]), ('Rx2', [5, 6, 7, 8])]:
+        for tx in txs:
+            slow = np.cumsum(rng.normal(scale=0.01, size=n))
+            data[f'{rx}-Tx{tx} O2Hb'] = (
+                slow + 0.1 * heartbeat + rng.normal(scale=0.05, size=n))
+            data[f'{rx}-Tx{tx} HHb'] = (
+                -0.5 * slow - 0.05 * heartbeat
+                + rng.normal(scale=0.05, size=n))
+    events = np.full(n, np.nan, dtype=object)
+    events[[4 * fs, 24 * fs, 144 * fs]] = ['S1', 'W1', 'S2']
+    data['Event'] = events
+    df = pd.DataFrame(data=data, index=np.arange(fs, n + fs))
+    metadata = {'Datafile sample rate': fs, 'Export file': 'synthetic.txt'}
+
+    return {'metadata': metadata, 'data': df}
 
 
 class TestTransformData(unittest.TestCase):
@@ -175,4 +223,658 @@ class TestBaseline(unittest.TestCase):
             baseline_subtraction(self.test_frame, bad_events)
 
 
+class TestGroupStatistics(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        data = rng.normal(size=(20, 4))
+        # Only the first feature differs between groups
+        data[:10, 0] += 3
+        self.stats = pd.DataFrame(data=data, columns=['a', 'b', 'c', 'd'])
+        self.groups = ['PD-ED'] * 10 + ['PD'] * 10
+
+    def test_t_statistic(self):
+        result = permutation_test(self.stats, self.groups,
+                                  n_permutations=200, seed=1)
+        expected = stats.ttest_ind(self.stats.iloc[:10], self.stats.iloc[10:],
+                                   equal_var=False).statistic
+        np.testing.assert_allclose(result['t'], expected)
+
+    def test_permutation_p(self):
+        result = permutation_test(self.stats, self.groups,
+                                  n_permutations=500, seed=1, max_bytes=1000)
+        self.assertLess(result.loc['a', 'p corrected'], 0.01)
+        self.assertTrue((result['p corrected'] >= result['p']).all())
+        # The same seed reproduces the same result
+        again = permutation_test(self.stats, self.groups,
+                                 n_permutations=500, seed=1, max_bytes=1000)
+        pd.testing.assert_frame_equal(result, again)
+
+    def test_bootstrap_ci(self):
+        result = bootstrap_ci(self.stats, self.groups, n_boot=1000, seed=1)
+        self.assertGreater(result.loc['a', 'CI lower'], 0)
+        self.assertTrue((result['CI lower'] <= result['Mean difference']).all())
+        self.assertTrue((result['CI upper'] >= result['Mean difference']).all())
+
+        with self.assertRaises(ValueError):
+            bootstrap_ci(self.stats, ['PD'] * 20)
+
+
+class TestGLM(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n = 3000
+        events = np.full(n, np.nan, dtype=object)
+        events[[100, 1100, 2600]] = 'Marker'
+        self.design = design_matrix(n, 1100, 2600, 50)
+        betas = np.array([[2.0, -1.0], [0.5, 0.1], [0.0, 3.0]])
+        values = self.design @ betas + rng.normal(scale=0.1, size=(n, 2))
+        self.frame = pd.DataFrame(data={'Sample number': np.arange(n),
+                                        'Rx1-Tx1 O2Hb': values[:, 0],
+                                        'Rx1-Tx1 HHb': values[:, 1],
+                                        'Event': events})
+
+    def test_glm(self):
+        result = glm_statistics(self.frame, 'dir/subject.txt', 50)
+        values = np.array(self.frame[['Rx1-Tx1 O2Hb', 'Rx1-Tx1 HHb']])
+        expected, *_ = np.linalg.lstsq(self.design, values, rcond=None)
+        self.assertEqual(list(result.index), ['subject.txt'])
+        # With white noise the prewhitened fit matches least squares
+        self.assertAlmostEqual(result['Walking Rx1-Tx1 O2Hb Beta'].iloc[0],
+                               expected[0, 0], places=2)
+        self.assertAlmostEqual(result['Walking Rx1-Tx1 HHb Beta'].iloc[0],
+                               expected[0, 1], places=2)
+        self.assertGreater(result['Walking Rx1-Tx1 O2Hb t'].iloc[0], 10)
+
+        with self.assertRaises(IndexError):
+            glm_statistics(self.frame.assign(Event=np.nan), 'subject.txt', 50)
+
+    def test_autocorrelated_noise(self):
+        # No activation, strongly autocorrelated AR(2) noise
+        rng = np.random.default_rng(1)
+        noise = rng.normal(size=(3000, 40))
+        for t in range(2, len(noise)):
+            noise[t] += 1.6 * noise[t - 1] - 0.65 * noise[t - 2]
+        frame = pd.DataFrame(data=noise,
+                             columns=[f'Rx1-Tx{i} O2Hb' for i in range(40)])
+        frame['Event'] = self.frame['Event']
+        result = glm_statistics(frame, 'subject.txt', 50)
+        t_values = np.array(result.filter(regex=' t$')).ravel()
+        # Close to the nominal 5% false positive rate, where ordinary least
+        # squares t-values would flag most channels
+        self.assertLess(np.mean(np.abs(t_values) > 1.96), 0.15)
+
+
+class TestConnectivity(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n = 400
+        chs = ['Rx1-Tx1 O2Hb', 'Rx1-Tx1 HHb', 'Rx2-Tx5 O2Hb', 'Rx2-Tx5 HHb']
+        self.frame = pd.DataFrame(data=rng.normal(size=(n, 4)), columns=chs)
+        self.frame.insert(0, 'Sample number', np.arange(n) + 50)
+        self.frame['Event'] = np.nan
+
+    def test_derived_signals(self):
+        derived = derived_signals(self.frame)
+        self.assertEqual(list(derived.columns)[-1], 'Event')
+        np.testing.assert_allclose(
+            derived['Rx2-Tx5 HbT'],
+            self.frame['Rx2-Tx5 O2Hb'] + self.frame['Rx2-Tx5 HHb'])
+        np.testing.assert_allclose(
+            derived['Rx1-Tx1 HbDiff'],
+            self.frame['Rx1-Tx1 O2Hb'] - self.frame['Rx1-Tx1 HHb'])
+
+    def test_sliding_connectivity(self):
+        result = sliding_connectivity(self.frame, window=100, step=30)
+        values = np.array(self.frame.iloc[:, 1:5])
+        self.assertEqual(result['correlation'].shape, (11, 4, 4))
+        for idx, start in enumerate(range(0, 301, 30)):
+            expected = np.corrcoef(values[start:start + 100], rowvar=False)
+            np.testing.assert_allclose(result['correlation'][idx], expected,
+                                       atol=1e-10)
+        self.assertEqual(result['starts'][1], 80)
+
+        inter = interhemispheric_connectivity(result)
+        np.testing.assert_allclose(inter['O2Hb'],
+                                   result['correlation'][:, 0, 2])
+
+
+class TestQuality(unittest.TestCase):
+    def setUp(self):
+        self.raw = synthetic_raw()
+        self.short_chs = ['Rx1-Tx4', 'Rx2-Tx6']
+
+    def test_signal_quality(self):
+        raw = synthetic_raw()
+        df = raw['data']
+        df['Rx1-Tx2 O2Hb'] = 0.0
+        df['Rx2-Tx7 HHb'] = np.clip(df['Rx2-Tx7 HHb'], -0.05, 0.05)
+        df.loc[3000:3050, 'Rx2-Tx8 O2Hb'] += 50
+        report = signal_quality(raw)
+        self.assertEqual(list(report.index[~report['Pass']]),
+                         ['Rx1-Tx2', 'Rx2-Tx7', 'Rx2-Tx8'])
+        self.assertEqual(report.loc['Rx1-Tx2', 'Flat'], 1.0)
+        self.assertGreater(report.loc['Rx2-Tx7', 'Saturated'], 0.01)
+        self.assertTrue(is_usable(report, self.short_chs))
+        self.assertFalse(is_usable(report, self.short_chs, min_fraction=0.6))
+
+    def test_process_with_qc(self):
+        self.raw['data']['Rx1-Tx2 O2Hb'] = 0.0
+        processed = process_fnirs(self.raw, self.short_chs, qc=True)
+        self.assertNotIn('Rx1-Tx2 HHb', processed.columns)
+        self.assertIn('Rx1-Tx1 HHb', processed.columns)
+        self.assertFalse(processed.attrs['quality'].loc['Rx1-Tx2', 'Pass'])
+
+        self.raw['data']['Rx1-Tx4 HHb'] = 0.0
+        with self.assertRaises(ValueError):
+            process_fnirs(self.raw, self.short_chs, qc=True)
+
+    def test_batch_report(self):
+        bad = synthetic_raw(1)
+        bad['data']['Rx1-Tx4 HHb'] = 0.0
+        partial = synthetic_raw(2)
+        partial['data']['Rx1-Tx2 O2Hb'] = 0.0
+        recordings = {'bad.txt': bad, 'good.txt': self.raw,
+                      'partial.txt': partial}
+        results, timing = process_files(list(recordings), self.short_chs,
+                                        reader=recordings.get, qc=True)
+        # The unusable recording is skipped without stopping the batch
+        self.assertEqual(list(results), ['good.txt', 'partial.txt'])
+        self.assertEqual(timing['failed'], {})
+        self.assertNotIn('Rx1-Tx2 O2Hb', results['partial.txt'].columns)
+
+        report = timing['quality']
+        usable = report.groupby(level='File')['Usable'].all()
+        self.assertEqual(usable.to_dict(), {'bad.txt': False, 'good.txt': True,
+                                            'partial.txt': True})
+        self.assertFalse(report.loc[('partial.txt', 'Rx1-Tx2'), 'Pass'])
+
+        reports = {file: df.attrs['quality'] for file, df in results.items()}
+        pd.testing.assert_frame_equal(
+            quality_report(reports, self.short_chs),
+            report.drop(index='bad.txt'))
+
+    def test_average_exclude(self):
+        processed = process_fnirs(self.raw, self.short_chs)
+        averaged = average_channels(processed, exclude=['Rx1-Tx2'])
+        kept = ['Rx1-Tx1', 'Rx1-Tx3']
+        np.testing.assert_allclose(
+            averaged['right oxy'],
+            processed[[ch + ' O2Hb' for ch in kept]].mean(axis=1))
+        grand = [ch for ch in processed.columns
+                 if ch.endswith(' HHb') and not ch.startswith('Rx1-Tx2')]
+        np.testing.assert_allclose(averaged['grand dxy'],
+                                   processed[grand].mean(axis=1))
+        # Without exclude the channel is part of the averages
+        self.assertFalse(np.allclose(
+            average_channels(processed)['right oxy'], averaged['right oxy']))
+
+
+class TestPipeline(unittest.TestCase):
+    def setUp(self):
+        self.raw = synthetic_raw()
+        self.short_chs = ['Rx1-Tx4', 'Rx2-Tx6']
+        self.config = {'stages': ['ssc',
+                                  {'tddr': None},
+                                  {'fir': {'order': 50, 'fs': 50}},
+                                  'baseline']}
+
+    def test_matches_process_fnirs(self):
+        pipeline = Pipeline.from_config(self.config)
+        expected = process_fnirs(self.raw, self.short_chs)
+        result = pipeline.run(self.raw, self.short_chs)
+        pd.testing.assert_frame_equal(expected, result)
+
+    def test_plan(self):
+        plan = Pipeline.from_config(self.config).plan()
+        self.assertEqual([[name for name, _ in step] for step in plan.steps],
+                         [['ssc'], ['tddr', 'fir'], ['baseline']])
+        # Defaults are bound, so spelling them out gives the same plan
+        config = dict(self.config)
+        config['stages'] = ['ssc', {'tddr': {'tune': 4.685}},
+                            {'fir': {'order': 50, 'fs': 50,
+                                     'Wn': [0.01, 0.1]}},
+                            'baseline']
+        same = Pipeline.from_config(config).plan()
+        self.assertEqual(plan, same)
+        self.assertEqual(plan.key, same.key)
+        self.assertEqual(len({plan, same}), 1)
+
+        # Stages after the last requested output are skipped
+        config['outputs'] = ['raw', 'tddr']
+        partial = Pipeline.from_config(config).plan()
+        self.assertEqual([[name for name, _ in step]
+                          for step in partial.steps], [['ssc'], ['tddr']])
+
+        with self.assertRaises(TypeError):
+            Pipeline([('fir', {'cutoff': 0.1})])
+        with self.assertRaises(KeyError):
+            Pipeline([('wavelet', {})])
+
+    def test_outputs(self):
+        config = dict(self.config)
+        config['stages'] = config['stages'] + [{'decimate': {'factor': 5}}]
+        config['outputs'] = ['raw', 'tddr', 'decimate']
+        results = Pipeline.from_config(config).run_with_outputs(
+            self.raw, self.short_chs)
+        self.assertEqual(list(results), ['raw', 'tddr', 'decimate'])
+        self.assertEqual(len(results['decimate']), len(self.raw['data']) // 5)
+        self.assertEqual(results['decimate']['Event'].notnull().sum(), 3)
+
+
+class TestSweep(unittest.TestCase):
+    def setUp(self):
+        self.raw = synthetic_raw()
+        self.short_chs = ['Rx1-Tx4', 'Rx2-Tx6']
+        self.config = {'stages': ['ssc', 'tddr', {'fir': {'order': 50}},
+                                  'baseline']}
+        self.grid = {'tddr.tune': [4.685, 3.0],
+                     'fir.Wn': [[0.01, 0.1], [0.01, 0.2]],
+                     'segments.split': [0.5, 0.25]}
+
+    def test_tree(self):
+        pipelines = [_override(self.config, ['tddr.tune', 'fir.order'],
+                               combo)
+                     for combo in [(4.685, 50), (4.685, 100), (3.0, 50)]]
+        tree = _build_tree(pipelines)
+        ssc = pipelines[0].stages[0]
+        # One SSC node shared by all, one TDDR node per tuning constant
+        self.assertEqual(list(tree), [ssc])
+        self.assertEqual(len(tree[ssc]), 2)
+        self.assertEqual(len(tree[ssc][pipelines[0].stages[1]]), 2)
+
+    def test_sweep(self):
+        with mock.patch('processing.sweep.read_raw', return_value=self.raw):
+            result = sweep(['dir/subject.txt'], self.short_chs, self.config,
+                           self.grid, processes=1)
+        self.assertEqual(len(result), 8)
+        self.assertEqual(result.index.names,
+                         ['tddr.tune', 'fir.Wn', 'segments.split', 'File'])
+
+        config = {'stages': ['ssc', {'tddr': {'tune': 3.0}},
+                             {'fir': {'order': 50, 'Wn': [0.01, 0.2]}},
+                             'baseline']}
+        processed = Pipeline.from_config(config).run(self.raw,
+                                                     self.short_chs)
+        segments = create_segments(processed, 0.25)
+        expected = calculate_statistics(segments, 'dir/subject.txt')
+        row = result.loc[(3.0, (0.01, 0.2), 0.25, 'subject.txt')]
+        np.testing.assert_allclose(row[expected.columns], expected.iloc[0])
+
+    def test_duplicate_names(self):
+        files = ['visit1/subject.txt', 'visit2/subject.txt']
+        grid = {'tddr.tune': [4.685, 3.0]}
+        with mock.patch('processing.sweep.read_raw', return_value=self.raw):
+            result = sweep(files, self.short_chs, self.config, grid,
+                           processes=1)
+        self.assertTrue(result.index.is_unique)
+        self.assertEqual(sorted(result.index.get_level_values('File')),
+                         sorted(files * 2))
+
+
+class TestPrefetch(unittest.TestCase):
+    def setUp(self):
+        self.raw = synthetic_raw()
+        self.files = [f'subject_{i}.txt' for i in range(5)]
+
+    def slow_reader(self, file):
+        time.sleep(0.05)
+        if file == 'missing.txt':
+            raise FileNotFoundError(file)
+        return self.raw
+
+    def test_prefetch(self):
+        order = list()
+        with Prefetcher(self.files, reader=self.slow_reader) as recordings:
+            for file, raw in recordings:
+                order.append(file)
+                time.sleep(0.05)
+        self.assertEqual(order, self.files)
+        # Reads after the first overlap with the consumer's work
+        self.assertLess(recordings.stats['wait'],
+                        0.6 * recordings.stats['read'])
+
+    def test_byte_budget(self):
+        prefetcher = Prefetcher(self.files, max_files=4, max_bytes=1,
+                                reader=self.slow_reader)
+        for _ in prefetcher:
+            time.sleep(0.1)
+            self.assertLessEqual(len(prefetcher._buffer), 1)
+
+    def test_error(self):
+        files = ['subject_1.txt', 'missing.txt', 'subject_2.txt']
+        with self.assertRaises(FileNotFoundError):
+            for _ in Prefetcher(files, reader=self.slow_reader):
+                pass
+
+        prefetcher = Prefetcher(files, reader=self.slow_reader,
+                                skip_errors=True)
+        self.assertEqual([file for file, _ in prefetcher],
+                         ['subject_1.txt', 'subject_2.txt'])
+        self.assertIsInstance(prefetcher.errors['missing.txt'],
+                              FileNotFoundError)
+
+    def test_process_files(self):
+        results, timing = process_files(self.files[:2],
+                                        ['Rx1-Tx4', 'Rx2-Tx6'],
+                                        reader=self.slow_reader)
+        self.assertEqual(list(results), self.files[:2])
+        self.assertLess(timing['wait'], timing['read'])
+        self.assertEqual(timing['failed'], {})
+
+    def test_process_files_errors(self):
+        bad = synthetic_raw()
+        bad['data'] = bad['data'].drop(columns=['Event'])
+        recordings = {'good.txt': self.raw, 'bad.txt': bad}
+
+        def reader(file):
+            if file not in recordings:
+                raise FileNotFoundError(file)
+            return recordings[file]
+
+        files = ['bad.txt', 'missing.txt', 'good.txt']
+        results, timing = process_files(files, ['Rx1-Tx4', 'Rx2-Tx6'],
+                                        reader=reader)
+        self.assertEqual(list(results), ['good.txt'])
+        self.assertEqual(list(timing['failed']), ['bad.txt', 'missing.txt'])
+        self.assertIsInstance(timing['failed']['bad.txt'], KeyError)
+
+
+@unittest.skipIf(_snirf.h5py is None, "h5py is not installed")
+class TestSnirf(unittest.TestCase):
+    def setUp(self):
+        self.raw = synthetic_raw()
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, 'subject.snirf')
+        fnirs_io.write_snirf(self.path, self.raw, chunk_samples=500)
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_roundtrip(self):
+        loaded = fnirs_io.read_raw(self.path)
+        pd.testing.assert_frame_equal(self.raw['data'], loaded['data'],
+                                      check_dtype=False)
+        self.assertEqual(loaded['metadata']['Export file'], 'synthetic.txt')
+        short_chs = ['Rx1-Tx4', 'Rx2-Tx6']
+        pd.testing.assert_frame_equal(process_fnirs(self.raw, short_chs),
+                                      process_fnirs(loaded, short_chs),
+                                      check_dtype=False)
+
+    def test_partial_read(self):
+        loaded = fnirs_io.read_snirf(self.path, channels=['Rx2-Tx5 HHb'],
+                                     start=1000, stop=1500)
+        expected = self.raw['data'].iloc[1000:1500][
+            ['Sample number', 'Rx2-Tx5 HHb', 'Event']]
+        pd.testing.assert_frame_equal(expected, loaded['data'],
+                                      check_dtype=False)
+        self.assertEqual(loaded['data']['Event'].notnull().sum(), 1)
+
+        with self.assertRaises(KeyError):
+            fnirs_io.read_snirf(self.path, channels=['Rx9-Tx9 HHb'])
+
+    def test_third_party(self):
+        # Minimal file: no sample rate tag, no probe labels, [start, step]
+        # time vector
+        path = os.path.join(self.tmp.name, 'other.snirf')
+        values = np.random.default_rng(0).normal(size=(100, 3))
+        with _snirf.h5py.File(path, 'w') as f:
+            f.create_dataset('formatVersion', data='1.1')
+            nirs = f.create_group('nirs')
+            tags = nirs.create_group('metaDataTags')
+            tags.create_dataset('SubjectID', data='s01')
+            data1 = nirs.create_group('data1')
+            data1.create_dataset('dataTimeSeries', data=values)
+            data1.create_dataset('time', data=[0.0, 0.1])
+            for idx, (source, label) in enumerate(
+                    [(1, 'HbO'), (1, 'HbR'), (2, 'HbO')]):
+                ml = data1.create_group(f'measurementList{idx + 1}')
+                ml.create_dataset('sourceIndex', data=source)
+                ml.create_dataset('detectorIndex', data=1)
+                ml.create_dataset('dataType', data=99999)
+                ml.create_dataset('dataTypeLabel', data=label)
+            probe = nirs.create_group('probe')
+            probe.create_dataset('wavelengths', data=[760.0, 850.0])
+            stim = nirs.create_group('stim1')
+            stim.create_dataset('name', data='start')
+            stim.create_dataset('data', data=[[2.0, 0.0, 1.0]])
+
+        loaded = fnirs_io.read_snirf(path)
+        self.assertAlmostEqual(
+            float(loaded['metadata']['Datafile sample rate']), 10.0)
+        df = loaded['data']
+        self.assertEqual(list(df.columns),
+                         ['Sample number', 'D1-S1 O2Hb', 'D1-S1 HHb',
+                          'D1-S2 O2Hb', 'Event'])
+        np.testing.assert_array_equal(df['Sample number'], np.arange(100))
+        np.testing.assert_array_equal(np.array(df.iloc[:, 1:4]), values)
+        self.assertEqual(df.loc[20, 'Event'], 'start')
+
+        with _snirf.h5py.File(path, 'r+') as f:
+            del f['nirs/data1/measurementList1/dataTypeLabel']
+            f['nirs/data1/measurementList1'].create_dataset(
+                'dataTypeLabel', data='dOD')
+        with self.assertRaises(ValueError):
+            fnirs_io.read_snirf(path)
+
+
+@unittest.skipIf(_snirf.h5py is None, "h5py is not installed")
+class TestResultsStore(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.short_chs = ['Rx1-Tx4', 'Rx2-Tx6']
+        self.files = list()
+        for seed in range(2):
+            path = os.path.join(self.tmp.name, f'subject_{seed}.snirf')
+            fnirs_io.write_snirf(path, synthetic_raw(seed))
+            self.files.append(path)
+        self.store = ResultsStore(os.path.join(self.tmp.name, 'results.db'))
+
+    def tearDown(self):
+        self.store.close()
+        self.tmp.cleanup()
+
+    def test_incremental(self):
+        result = process_cohort(self.files[:1], self.short_chs, self.store)
+        raw = fnirs_io.read_raw(self.files[0])
+        segments = create_segments(process_fnirs(raw, self.short_chs))
+        expected = calculate_statistics(segments, self.files[0])
+        pd.testing.assert_frame_equal(result[expected.columns], expected)
+
+        with mock.patch('processing.results_db.process_fnirs',
+                        wraps=process_fnirs) as process:
+            result = process_cohort(self.files, self.short_chs, self.store)
+            # Only the new recording is processed
+            self.assertEqual(process.call_count, 1)
+        self.assertEqual(list(result.index),
+                         ['subject_0.snirf', 'subject_1.snirf'])
+
+        means = self.store.query(segment='early', channel='Rx1-Tx1 O2Hb',
+                                 metric='Mean')
+        self.assertEqual(len(means), 2)
+        self.assertAlmostEqual(means['Value'].iloc[0],
+                               expected['early Rx1-Tx1 O2Hb Mean'].iloc[0])
+
+    def test_quality_flags(self):
+        raw = synthetic_raw(2)
+        raw['data']['Rx1-Tx4 HHb'] = 0.0
+        path = os.path.join(self.tmp.name, 'bad.snirf')
+        fnirs_io.write_snirf(path, raw)
+        result = process_cohort([path] + self.files, self.short_chs,
+                                self.store, qc=True)
+        self.assertEqual(list(result.index),
+                         ['subject_0.snirf', 'subject_1.snirf'])
+        usable = self.store.connection.execute(
+            "SELECT usable FROM recordings WHERE file = ?", (path,)
+            ).fetchone()
+        self.assertEqual(usable, (0,))
+
+    def test_moved_file(self):
+        expected = process_cohort(self.files[:1], self.short_chs, self.store)
+        moved_dir = os.path.join(self.tmp.name, 'moved')
+        os.mkdir(moved_dir)
+        moved = os.path.join(moved_dir, 'renamed.snirf')
+        os.rename(self.files[0], moved)
+
+        with mock.patch('processing.results_db.process_fnirs',
+                        wraps=process_fnirs) as process:
+            result = process_cohort([moved], self.short_chs, self.store)
+            # Matched by content, not path
+            self.assertEqual(process.call_count, 0)
+        self.assertEqual(list(result.index), ['renamed.snirf'])
+        np.testing.assert_array_equal(np.array(result),
+                                      np.array(expected))
+        self.assertIn(moved, list(self.store.query()['File']))
+
+    def test_restored_file(self):
+        path = self.files[0]
+        backup = os.path.join(self.tmp.name, 'backup.snirf')
+        shutil.copyfile(path, backup)
+        original = process_cohort([path], self.short_chs, self.store)
+        fnirs_io.write_snirf(path, synthetic_raw(5))
+        changed = process_cohort([path], self.short_chs, self.store)
+        shutil.copyfile(backup, path)
+
+        with mock.patch('processing.results_db.process_fnirs',
+                        wraps=process_fnirs) as process:
+            restored = process_cohort([path], self.short_chs, self.store)
+            self.assertEqual(process.call_count, 0)
+        pd.testing.assert_frame_equal(restored, original)
+
+        label = 'early Rx1-Tx1 O2Hb Mean'
+        means = self.store.query(segment='early', channel='Rx1-Tx1 O2Hb',
+                                 metric='Mean')
+        self.assertEqual(list(means['File']), [path])
+        self.assertAlmostEqual(means['Value'].iloc[0], original[label].iloc[0])
+        self.assertNotAlmostEqual(means['Value'].iloc[0],
+                                  changed[label].iloc[0])
+        params_key = self.store.query()['Params'].iloc[0]
+        pd.testing.assert_frame_equal(self.store.statistics(params_key),
+                                      original)
+
+    def test_duplicate_names(self):
+        files = list()
+        for visit in ['visit1', 'visit2']:
+            os.mkdir(os.path.join(self.tmp.name, visit))
+            files.append(os.path.join(self.tmp.name, visit, 'subject.snirf'))
+        fnirs_io.write_snirf(files[0], synthetic_raw(0))
+        fnirs_io.write_snirf(files[1], synthetic_raw(1))
+        # An identical copy is processed only once
+        copy = os.path.join(self.tmp.name, 'copy.snirf')
+        shutil.copyfile(files[0], copy)
+
+        with mock.patch('processing.results_db.process_fnirs',
+                        wraps=process_fnirs) as process:
+            result = process_cohort(files + [copy], self.short_chs,
+                                    self.store)
+            self.assertEqual(process.call_count, 2)
+        self.assertEqual(list(result.index), files + [copy])
+        np.testing.assert_array_equal(np.array(result.loc[files[0]]),
+                                      np.array(result.loc[copy]))
+
+
+class TestImportTime(unittest.TestCase):
+    # Budget for importing both packages, in microseconds
+    budget = 50000
+
+    @staticmethod
+    def run_python(code):
+        return subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', code],
+            capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)))
+
+    def test_import_time(self):
+        result = self.run_python('import processing, fnirs_io')
+        cumulative = 0
+        for line in result.stderr.splitlines():
+            if not line.startswith('import time:'):
+                continue
+            fields = [field.strip() for field in line.split('|')]
+            if fields[2] in ['processing', 'fnirs_io']:
+                cumulative += int(fields[1])
+        self.assertGreater(cumulative, 0)
+        self.assertLess(cumulative, self.budget)
+
+    def test_lazy_imports(self):
+        code = (
+            "import sys, processing, fnirs_io\n"
+            "print(sorted(m for m in ['pandas', 'scipy'] if m in sys.modules))\n"
+            "processing.process_fnirs\n"
+            "fnirs_io.read_raw\n"
+            "print('scipy' in sys.modules)"
+            )
+        lines = self.run_python(code).stdout.splitlines()
+        self.assertEqual(lines, ['[]', 'False'])
+
+    def test_submodules(self):
+        code = (
+            "import processing, fnirs_io\n"
+            "print(processing.process.__name__, processing.filter.__name__)\n"
+            "print(type(processing.create_segments).__name__)\n"
+            "print(fnirs_io.prefetch.__name__)\n"
+            "print(hasattr(processing, 'missing'))"
+            )
+        lines = self.run_python(code).stdout.splitlines()
+        self.assertEqual(lines, ['processing.process processing.filter',
+                                 'function', 'fnirs_io.prefetch', 'False'])
+
+
+class TestReport(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.x = np.arange(1000, dtype=np.float64)
+        self.values = np.cumsum(rng.normal(size=(1000, 3)), axis=0)
+
+    @staticmethod
+    def lttb_reference(x, y, n_out):
+        every = (len(x) - 2) / (n_out - 2)
+        selected = [0]
+        for i in range(n_out - 2):
+            start = int(i * every) + 1
+            end = int((i + 1) * every) + 1
+            next_end = min(int((i + 2) * every) + 1, len(x))
+            avg_x = np.mean(x[end:next_end])
+            avg_y = np.mean(y[end:next_end])
+            a = selected[-1]
+            areas = [abs((x[a] - avg_x) * (y[j] - y[a])
+                         - (x[a] - x[j]) * (avg_y - y[a]))
+                     for j in range(start, end)]
+            selected.append(start + int(np.argmax(areas)))
+        selected.append(len(x) - 1)
+        return selected
+
+    def test_lttb(self):
+        idx = lttb_downsample(self.x, self.values, 50)
+        self.assertEqual(idx.shape, (50, 3))
+        for ch in range(3):
+            self.assertEqual(list(idx[:, ch]), self.lttb_reference(
+                self.x, self.values[:, ch], 50))
+
+    def test_minmax(self):
+        idx = minmax_downsample(self.values, 30)
+        self.assertEqual(idx.shape, (60, 3))
+        self.assertTrue((np.diff(idx, axis=0) >= 0).all())
+        for ch in range(3):
+            kept = self.values[idx[:, ch], ch]
+            self.assertEqual(kept.max(), self.values[:, ch].max())
+            self.assertEqual(kept.min(), self.values[:, ch].min())
+
+        # Short traces are kept whole
+        idx = minmax_downsample(self.values[:40], 30)
+        self.assertEqual(idx.shape, (40, 3))
+        np.testing.assert_array_equal(idx[:, 0], np.arange(40))
+
+    @unittest.skipIf(importlib.util.find_spec('matplotlib') is None,
+                     "matplotlib is not installed")
+    def test_generate_reports(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            with mock.patch('processing.report.read_raw',
+                            return_value=synthetic_raw()):
+                pages = generate_reports(['dir/subject.txt'],
+                                         ['Rx1-Tx4', 'Rx2-Tx6'], tmp,
+                                         processes=1, width=800)
+            self.assertEqual(pages, [os.path.join(tmp, 'subject.png')])
+            self.assertTrue(os.path.getsize(pages[0]) > 0)
+
+
 unittest.main(verbosity=2)